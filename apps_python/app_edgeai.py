@@ -32,7 +32,9 @@
 import sys
 import yaml
 
-from edge_ai_class import EdgeAIDemo
+from edge_ai_class import EdgeAIDemo, load_cached_plan
+import gst_wrapper
+from control_socket import ControlServer
 import utils
 
 
@@ -42,10 +44,24 @@ def main(sys_argv):
     with open(args.config, "r") as f:
         config = yaml.safe_load(f)
 
+    if args.explain_plan:
+        # Print the cached plan without building the demo. Else resolve
+        # it, without starting infer pipes and post process workers
+        _, plan = load_cached_plan(config)
+        if plan == None:
+            plan = EdgeAIDemo(config, plan_only=True).plan
+        gst_wrapper.print_plan(plan)
+        return
+
+    control_server = None
     try:
         demo = EdgeAIDemo(config)
         demo.start()
 
+        if args.control_socket:
+            control_server = ControlServer(demo, args.control_socket)
+            control_server.start()
+
         if args.verbose:
             utils.print_stdout = True
 
@@ -56,7 +72,8 @@ def main(sys_argv):
     except KeyboardInterrupt:
         demo.stop()
     finally:
-        pass
+        if control_server:
+            control_server.stop()
 
     utils.disable_curses_reports()
 
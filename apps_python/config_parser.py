@@ -2,6 +2,7 @@ from gst_element_map import gst_element_map
 import gst_wrapper
 import yaml
 from post_process import create_title_frame, overlay_model_name
+from metadata_writer import MetadataWriter
 import os
 import utils
 import debug
@@ -17,11 +18,13 @@ class Input:
 
     count = 0
 
-    def __init__(self, input_config):
+    def __init__(self, input_config, build_elements=True):
         """
         Constructor of Input class
         Args:
             input_config: Dictionary of input params provided in config file
+            build_elements: Build the gst elements of the input. Not needed
+                            when the pipelines are parsed from a plan
         """
         self.source = input_config["source"]
         self.width = input_config["width"]
@@ -59,10 +62,84 @@ class Input:
             self.sen_id = input_config["sen-id"]
         else:
             self.sen_id = "imx219"
+        if "pipeline-depth" in input_config:
+            self.pipeline_depth = input_config["pipeline-depth"]
+        else:
+            self.pipeline_depth = 0
+        if "pair-window" in input_config:
+            self.pair_window = input_config["pair-window"]
+        else:
+            self.pair_window = 0
+        if "motion-threshold" in input_config:
+            self.motion_threshold = input_config["motion-threshold"]
+        else:
+            self.motion_threshold = 0
+        if "max-latency-ms" in input_config:
+            self.max_latency_ms = input_config["max-latency-ms"]
+        else:
+            self.max_latency_ms = 0
+        if "post-proc-workers" in input_config:
+            self.post_proc_workers = input_config["post-proc-workers"]
+        else:
+            self.post_proc_workers = 0
+        if "reconnect-timeout" in input_config:
+            self.reconnect_timeout = input_config["reconnect-timeout"]
+        else:
+            self.reconnect_timeout = 60
+        if "cache-dir" in input_config:
+            self.cache_dir = os.path.expanduser(input_config["cache-dir"])
+        else:
+            self.cache_dir = gst_wrapper.CLIP_CACHE_DIR
+        if "cache-size-mb" in input_config:
+            self.cache_size_mb = input_config["cache-size-mb"]
+        else:
+            self.cache_size_mb = 4096
         self.id = Input.count
         Input.count += 1
         self.split_count = 0
         self.splits = 0
+        self.check_held_buffers()
+        self.gst_inp_elements = []
+        if build_elements:
+            self.build_elements()
+
+    def check_held_buffers(self):
+        """
+        Exit if pipeline-depth and pair-window let the app hold more
+        samples of an appsink than the out-pool-size of the element
+        feeding it allows. Pulled tensors and frames keep their buffers
+        mapped till they are released, so the upstream pool would drain
+        and stall the source.
+        """
+        # Held by capture, inference and post-process stages and queues
+        tensors, frames = 1, 1
+        if self.pipeline_depth > 0:
+            tensors = self.pipeline_depth + 2
+            frames = 2 * self.pipeline_depth + 3
+        tensors += self.pair_window
+        frames += self.pair_window
+
+        for operation, held in (("dlpreproc", tensors), ("dlcolorconvert", frames)):
+            config = gst_element_map.get(operation)
+            if not config or "property" not in config:
+                continue
+            pool_size = config["property"].get("out-pool-size")
+            # Upstream element needs a free buffer and one in flight
+            if pool_size and held > pool_size - 2:
+                print(
+                    "[ERROR] pipeline-depth %d and pair-window %d of %s hold up"
+                    % (self.pipeline_depth, self.pair_window, self.source)
+                    + " to %d buffers of %s, which has out-pool-size %d."
+                    % (held, config["element"], pool_size)
+                    + " Lower them or raise out-pool-size in plugins map."
+                )
+                sys.exit()
+
+    def build_elements(self):
+        """
+        Build the gst elements of the input, probing or decoding the
+        source as needed
+        """
         self.gst_inp_elements = gst_wrapper.get_input_elements(self)
 
     def increase_split(self):
@@ -86,8 +163,24 @@ class Output:
             title: Title of the demo to be added in the output
         """
         self.sink = output_config["sink"]
-        self.width = output_config["width"]
-        self.height = output_config["height"]
+        # Metadata outputs get the decoded results instead of the frames
+        self.metadata = self.sink == "metadata"
+        self.metadata_writer = None
+        if self.metadata:
+            self.width = 0
+            self.height = 0
+            if "location" in output_config:
+                self.location = output_config["location"]
+            else:
+                self.location = "metadata.jsonl"
+            if "format" in output_config:
+                self.format = output_config["format"]
+            else:
+                self.format = "json"
+            self.metadata_writer = MetadataWriter(self.location, self.format)
+        else:
+            self.width = output_config["width"]
+            self.height = output_config["height"]
         self.fps = 0
         if "connector" in output_config:
             self.connector = output_config["connector"]
@@ -206,13 +299,15 @@ class Flow:
 
     count = 0
 
-    def __init__(self, input, subflow_list, debug_config):
+    def __init__(self, input, subflow_list, debug_config, build_elements=True):
         """
         Constructor of Flow class.
         Args:
             flow_config: Dictionary of flow params provided in config file
             input: Input object for the flow
             subflow_list: Multi-dimensional list containing subflow info.
+            build_elements: Build the gst elements of the subflows. Not
+                            needed when the pipelines are parsed from a plan
         """
         self.id = Flow.count
         self.sub_flows = []
@@ -226,10 +321,20 @@ class Flow:
         SubFlow.scaler_split_count = 0
 
         for s in subflow_list:
-            self.sub_flows.append(SubFlow(input, s, self))
+            self.sub_flows.append(SubFlow(input, s, self, build_elements))
 
         Flow.count += 1
 
+    def build_elements(self):
+        """
+        Build the gst elements of the input and subflows of a flow which
+        was constructed without them
+        """
+        if not self.input.gst_inp_elements:
+            self.input.build_elements()
+        for s in self.sub_flows:
+            s.build_elements()
+
 
 class SubFlow:
     """
@@ -240,18 +345,24 @@ class SubFlow:
     count = 0
     scaler_split_count = 0
 
-    def __init__(self, input, subflow_list, flow):
+    def __init__(self, input, subflow_list, flow, build_elements=True):
         """
         Constructor of SubFlow class.
         Args:
             input: Input object for the flow
             subflow_list: List containing subflow info.
             flow: Parent flow of this subflow
+            build_elements: Build the gst elements of the subflow
         """
         self.input = input
         self.model = subflow_list[0]
-        self.outputs = subflow_list[1]
-        self.mosaic_list = subflow_list[2]
+        self.outputs = [o for o in subflow_list[1] if not o.metadata]
+        self.mosaic_list = [
+            m for o, m in zip(subflow_list[1], subflow_list[2]) if not o.metadata
+        ]
+        self.metadata_outputs = [o for o in subflow_list[1] if o.metadata]
+        # Subflow with only metadata outputs does not need the sensor path
+        self.headless = len(self.outputs) == 0
         self.id = SubFlow.count
 
         self.sensor_width = 0
@@ -300,21 +411,35 @@ class SubFlow:
             self.input.id,
             SubFlow.scaler_split_count + 1,
         )
-        self.gst_scaler_elements = gst_wrapper.get_scaler_elements(
-            self, is_multi_src=flow.is_multi_scaler
-        )
         self.gst_pre_src_name = "pre_%d" % self.id
-        self.gst_pre_proc_elements = gst_wrapper.get_pre_proc_elements(self)
         self.input.increase_split()
         self.gst_sen_src_name = "sen_%d" % self.id
-        self.gst_sensor_elements = gst_wrapper.get_sensor_elements(self)
-        self.input.increase_split()
         self.gst_post_sink_name = "post_%d" % self.id
-        self.gst_post_proc_elements = gst_wrapper.get_post_proc_elements(self)
-        self.report = utils.Report(self)
+        if not self.headless:
+            self.input.increase_split()
         self.flow = flow
+        self.gst_scaler_elements = []
+        self.gst_pre_proc_elements = []
+        self.gst_sensor_elements = []
+        self.gst_post_proc_elements = []
+        if build_elements:
+            self.build_elements()
+        self.report = utils.Report(self)
         self.debug_config = None
         if flow.debug_config:
             self.debug_config = debug.DebugConfig(self, flow.debug_config)
         SubFlow.count += 1
         SubFlow.scaler_split_count += 1
+
+    def build_elements(self):
+        """
+        Build the gst elements of the dl path and, unless headless, of the
+        sensor path and post processing of the subflow
+        """
+        self.gst_scaler_elements = gst_wrapper.get_scaler_elements(
+            self, is_multi_src=self.flow.is_multi_scaler
+        )
+        self.gst_pre_proc_elements = gst_wrapper.get_pre_proc_elements(self)
+        if not self.headless:
+            self.gst_sensor_elements = gst_wrapper.get_sensor_elements(self)
+            self.gst_post_proc_elements = gst_wrapper.get_post_proc_elements(self)
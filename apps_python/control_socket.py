@@ -0,0 +1,136 @@
+#  Copyright (C) 2021 Texas Instruments Incorporated - http://www.ti.com/
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import socket
+import threading
+
+
+class ControlServer:
+    """
+    Class to serve a local unix socket to attach and detach flows of a
+    running EdgeAIDemo. Each connection sends one command per line:
+        attach <name> <input> <model> <output> <x> <y> <w> <h>
+        detach <name>
+        list
+    and gets "OK [info]" or "ERROR <reason>" back for every command.
+    """
+
+    def __init__(self, demo, path):
+        """
+        Constructor of ControlServer class
+        Args:
+            demo: EdgeAIDemo object to be controlled
+            path: path of the unix socket
+        """
+        self.demo = demo
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            os.remove(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(1)
+        self.stop_thread = False
+        # Connection being served, shut down by stop
+        self.conn = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """
+        Start serving the socket
+        """
+        self.thread.start()
+
+    def run(self):
+        """
+        Accept connections and serve them one at a time
+        """
+        while not self.stop_thread:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break
+            self.conn = conn
+            try:
+                with conn, conn.makefile("rw") as f:
+                    for line in f:
+                        f.write(self.handle(line.split()) + "\n")
+                        f.flush()
+            except OSError:
+                pass
+            self.conn = None
+
+    def handle(self, args):
+        """
+        Run a command and return the reply
+        Args:
+            args: command split into words
+        """
+        if not args:
+            return "ERROR empty command"
+        try:
+            with self.lock:
+                if args[0] == "attach" and len(args) == 9:
+                    mosaic = [int(i) for i in args[5:9]]
+                    self.demo.attach_flow(args[1], args[2:5] + [mosaic])
+                    return "OK"
+                elif args[0] == "detach" and len(args) == 2:
+                    self.demo.detach_flow(args[1])
+                    return "OK"
+                elif args[0] == "list" and len(args) == 1:
+                    return "OK " + " ".join(self.demo.flow_names)
+        except ValueError as err:
+            return "ERROR %s" % err
+        except SystemExit:
+            # Config errors are reported with sys.exit by config_parser
+            return "ERROR invalid flow configuration"
+        return "ERROR unknown command %s" % " ".join(args)
+
+    def stop(self):
+        """
+        Stop serving and remove the socket. Closing a socket does not wake
+        a thread blocked in accept or recv, hence the sockets are shut down
+        before the thread is joined
+        """
+        self.stop_thread = True
+        for sock in (self.server, self.conn):
+            if sock == None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.thread.is_alive():
+            self.thread.join()
+        self.server.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -33,10 +33,24 @@ import gst_wrapper
 from gst_element_map import gst_element_map
 from edgeai_dl_inferer import ModelConfig
 from infer_pipe import InferPipe
+from infer_broker import InferBroker
 import utils
 import sys
 import os
 
+def load_cached_plan(config):
+    """
+    Returns (key, plan) of the pipeline plan of a config, plan is None if
+    it is not cached or --replan or --reprobe is given
+    Args:
+        config: Dictionary of params pased from config file
+    """
+    plan_key = gst_wrapper.get_plan_key(config)
+    if utils.args.replan or utils.args.reprobe:
+        return plan_key, None
+    return plan_key, gst_wrapper.load_plan(plan_key)
+
+
 class EdgeAIDemo:
     """
     Abstract the functionality required for the Edge AI demo.
@@ -45,11 +59,13 @@ class EdgeAIDemo:
     """
     C7_CORE_ID_INDEX = 0
 
-    def __init__(self, config):
+    def __init__(self, config, plan_only=False):
         """
         Constructor of EdgeAIDemo class
         Args:
             config: Dictionary of params pased from config file
+            plan_only: Stop once the pipeline plan is resolved, without
+                       building infer pipes, brokers and the GstPipe
         """
         self.config = config
         self.models = {}
@@ -57,8 +73,17 @@ class EdgeAIDemo:
         self.outputs = {}
         self.flows = []
         self.infer_pipes = []
+        self.infer_brokers = {}
+        # Name of flow in config to its Flow object
+        self.flow_names = {}
         self.title = config["title"]
 
+        # Use the pipeline plan resolved on an earlier run of same config.
+        # Elements of inputs and flows are not built when there is a plan,
+        # since the pipelines are parsed from it
+        plan_key, self.plan = load_cached_plan(config)
+        build_elements = self.plan == None
+
         for f in config["flows"]:
             flow = config["flows"][f]
 
@@ -86,35 +111,12 @@ class EdgeAIDemo:
 
             # Parse Input/Model/Output Objects
             if model not in self.models:
-                model_config =  config["models"][model]
-                model_path = model_config["model_path"]
-                # Make model Config. This class is present in edgeai_dl_inferer
-                enable_tidl = False
-                core_id = 1
-                if (gst_element_map['inferer']['target'] == 'dsp'):
-                    enable_tidl = True
-                    if 'core-id' in gst_element_map['inferer']:
-                        core_id = gst_element_map['inferer']['core-id'][EdgeAIDemo.C7_CORE_ID_INDEX]
-                        EdgeAIDemo.C7_CORE_ID_INDEX += 1
-                        if EdgeAIDemo.C7_CORE_ID_INDEX >= len(gst_element_map['inferer']['core-id']):
-                            EdgeAIDemo.C7_CORE_ID_INDEX = 0
-                elif (gst_element_map['inferer']['target'] != 'arm'):
-                    print("[WARNING] Invalid target specified for inferer. Defaulting to ARM.")
-
-                model_obj = ModelConfig(model_path,enable_tidl,core_id)
-                # task specific params
-                if "alpha" in model_config:
-                    model_obj.alpha = model_config["alpha"]
-                if "viz_threshold" in model_config:
-                    model_obj.viz_threshold = model_config["viz_threshold"]
-                if "topN" in model_config:
-                    model_obj.topN = model_config["topN"]
-
+                model_obj = self.get_model_config(config["models"][model])
                 self.models[model] = model_obj
 
             if input not in self.inputs:
                 input_config = config["inputs"][input]
-                input_obj = config_parser.Input(input_config)
+                input_obj = config_parser.Input(input_config, build_elements)
                 input_obj.name = input
                 self.inputs[input] = input_obj
 
@@ -124,7 +126,12 @@ class EdgeAIDemo:
                 self.outputs[output] = output_obj
 
             # Set mosaic and start bg_pipeline
-            if len(flow) > 3 and flow[3] and not self.outputs[output].mosaic:
+            if (
+                len(flow) > 3
+                and flow[3]
+                and not self.outputs[output].mosaic
+                and not self.outputs[output].metadata
+            ):
                 self.outputs[output].set_mosaic()
 
         #Check if debug is enabled
@@ -176,19 +183,106 @@ class EdgeAIDemo:
                 output_objs, mosaic_list = subflow_dictionary[model]
                 subflow_list.append([model_obj, output_objs, mosaic_list])
 
-            self.flows.append(config_parser.Flow(input_obj, subflow_list, debug_config))
-
-        self.src_pipes, self.sink_pipe = gst_wrapper.get_gst_pipe(
-            self.flows, self.outputs
-        )
-        self.gst_pipe = gst_wrapper.GstPipe(self.src_pipes, self.sink_pipe)
+            self.flows.append(
+                config_parser.Flow(
+                    input_obj, subflow_list, debug_config, build_elements
+                )
+            )
+            for i in config["flows"]:
+                if config["flows"][i][0] == input:
+                    self.flow_names[i] = self.flows[-1]
+        self.debug_config = debug_config
+
+        self.src_pipes, self.sink_pipe = None, None
+        if self.plan:
+            self.src_pipes, self.sink_pipe = gst_wrapper.get_gst_pipe_from_plan(
+                self.plan, self.outputs
+            )
+        if self.src_pipes == None:
+            if not build_elements:
+                # Plan could not be used, build the elements after all
+                for f in self.flows:
+                    f.build_elements()
+            self.src_pipes, self.sink_pipe = gst_wrapper.get_gst_pipe(
+                self.flows, self.outputs
+            )
+            self.plan = gst_wrapper.make_plan(
+                self.src_pipes, self.sink_pipe, self.outputs
+            )
+            gst_wrapper.save_plan(plan_key, self.plan)
+        if plan_only:
+            return
+        self.gst_pipe = gst_wrapper.GstPipe(self.src_pipes, self.sink_pipe, self.flows)
 
         for o in self.outputs.values():
             o.gst_pipe = self.gst_pipe
 
+        # Share a broker between subflows using the same model instance
+        model_users = {}
+        for f in self.flows:
+            for s in f.sub_flows:
+                model_users[id(s.model)] = model_users.get(id(s.model), 0) + 1
         for f in self.flows:
             for s in f.sub_flows:
-                self.infer_pipes.append(InferPipe(s, self.gst_pipe))
+                if model_users[id(s.model)] > 1 and id(s.model) not in self.infer_brokers:
+                    self.infer_brokers[id(s.model)] = InferBroker(
+                        s.model, model_users[id(s.model)]
+                    )
+                broker = self.infer_brokers.get(id(s.model))
+                self.infer_pipes.append(InferPipe(s, self.gst_pipe, broker))
+
+    def get_model_config(self, model_config):
+        """
+        Returns ModelConfig object for a model
+        Args:
+            model_config: Dictionary of model params provided in config file
+        """
+        model_path = model_config["model_path"]
+        # Make model Config. This class is present in edgeai_dl_inferer
+        enable_tidl = False
+        core_id = 1
+        if (gst_element_map['inferer']['target'] == 'dsp'):
+            enable_tidl = True
+            if 'core-id' in gst_element_map['inferer']:
+                core_id = gst_element_map['inferer']['core-id'][EdgeAIDemo.C7_CORE_ID_INDEX]
+                EdgeAIDemo.C7_CORE_ID_INDEX += 1
+                if EdgeAIDemo.C7_CORE_ID_INDEX >= len(gst_element_map['inferer']['core-id']):
+                    EdgeAIDemo.C7_CORE_ID_INDEX = 0
+        elif (gst_element_map['inferer']['target'] != 'arm'):
+            print("[WARNING] Invalid target specified for inferer. Defaulting to ARM.")
+
+        model_obj = ModelConfig(model_path,enable_tidl,core_id)
+        # task specific params
+        if "alpha" in model_config:
+            model_obj.alpha = model_config["alpha"]
+        model_obj.palette = None
+        if "palette" in model_config:
+            model_obj.palette = model_config["palette"]
+        if "viz_threshold" in model_config:
+            model_obj.viz_threshold = model_config["viz_threshold"]
+        # Track the detections across frames
+        model_obj.tracker = None
+        if "tracker" in model_config:
+            model_obj.tracker = model_config["tracker"]
+            if type(model_obj.tracker) == dict:
+                for key in model_obj.tracker:
+                    if key not in ["iou_threshold", "max_age", "min_hits"]:
+                        print("[ERROR] Invalid tracker parameter %s" % key)
+                        sys.exit()
+        if "topN" in model_config:
+            model_obj.topN = model_config["topN"]
+        # Run inference only every infer_interval frames
+        model_obj.infer_interval = 1
+        if "infer_interval" in model_config:
+            model_obj.infer_interval = model_config["infer_interval"]
+        # params of inference broker used for shared models
+        model_obj.batch_timeout = 0
+        if "batch_timeout" in model_config:
+            model_obj.batch_timeout = model_config["batch_timeout"]
+        model_obj.batch = False
+        if "batch" in model_config:
+            model_obj.batch = model_config["batch"]
+        return model_obj
 
     def start(self):
         """
@@ -201,6 +295,8 @@ class EdgeAIDemo:
                 o.bg_pipe.free()
 
         self.gst_pipe.start()
+        for b in self.infer_brokers.values():
+            b.start()
         for i in self.infer_pipes:
             i.start()
 
@@ -214,12 +310,15 @@ class EdgeAIDemo:
             if o.mosaic:
                 for k, v in o.mosaic_prop.items():
                     mosaic_prop[k] = v
-        utils.print_sink_pipeline(self.gst_pipe.sink_pipe, mosaic_prop)
+        if self.sink_pipe != None:
+            utils.print_sink_pipeline(self.gst_pipe.sink_pipe, mosaic_prop)
 
         # Dump dot graph of the running pipeline
         if utils.args.dump_dot:
             ret_src = gst_wrapper.dump_dot_file(self.src_pipes, "src")
-            ret_sink = gst_wrapper.dump_dot_file([self.sink_pipe], "sink")
+            ret_sink = 0
+            if self.sink_pipe != None:
+                ret_sink = gst_wrapper.dump_dot_file([self.sink_pipe], "sink")
             if ret_src == 0 and ret_sink == 0:
                 print(
                     "\n[SUCCESS] GST Pipeline .dot graph successfully saved in %s"
@@ -233,6 +332,8 @@ class EdgeAIDemo:
         # Issue stop commands to the inference pipes
         for i in self.infer_pipes:
             i.stop()
+        # Do not keep waiting for lost sources
+        self.gst_pipe.stop_reconnecting()
 
         # Wait for the inference pipes to exit
         self.wait_for_exit()
@@ -248,4 +349,180 @@ class EdgeAIDemo:
         """
         for i in self.infer_pipes:
             i.wait_for_exit()
+        for b in self.infer_brokers.values():
+            b.stop()
         self.gst_pipe.free()
+        for o in self.outputs.values():
+            if o.metadata_writer:
+                o.metadata_writer.close()
+
+    def attach_flow(self, name, flow):
+        """
+        Attach a flow to the running demo. The flow gets its own input
+        pipeline and model instance and is added to the mosaic of an
+        existing output, other flows keep running.
+        Raises ValueError if the flow can not be attached.
+        Args:
+            name: Name of the flow
+            flow: [INPUT, MODEL, OUTPUT, MOSAIC[x,y,w,h]] as in config file
+        """
+        if name in self.flow_names:
+            raise ValueError("%s is already running" % name)
+        if len(flow) < 4 or not flow[3]:
+            raise ValueError("%s needs mosaic property to be attached" % name)
+        input, model, output = flow[0], flow[1], flow[2]
+        if input not in self.config["inputs"]:
+            raise ValueError("%s is not defined in inputs" % input)
+        if model not in self.config["models"]:
+            raise ValueError("%s is not defined in models" % model)
+        if output not in self.outputs or not self.outputs[output].mosaic:
+            raise ValueError("%s is not a running mosaic output" % output)
+        for f in self.flow_names.values():
+            if f.input.name == input:
+                raise ValueError("%s is already used by a running flow" % input)
+
+        flow_id = len(self.gst_pipe.src_pipe)
+        if config_parser.Flow.count != flow_id:
+            raise ValueError("Flow id of %s does not match src pipeline" % name)
+
+        # Everything changed by the attach, to be rolled back on failure
+        output_obj = self.outputs[output]
+        state = {
+            "counters": (
+                config_parser.Input.count,
+                config_parser.Flow.count,
+                config_parser.SubFlow.count,
+                config_parser.SubFlow.scaler_split_count,
+                EdgeAIDemo.C7_CORE_ID_INDEX,
+            ),
+            "output": (
+                len(output_obj.subflows),
+                output_obj.fps,
+                output_obj.title_frame,
+                output_obj.num_mosaic_sink,
+                {k: list(v) for k, v in output_obj.mosaic_prop.items()},
+            ),
+            "reports": len(utils.report_list),
+            "dynamic_links": len(gst_wrapper.dynamic_links),
+            "elements": set(e.get_name() for e in self.sink_pipe.iterate_elements()),
+        }
+
+        # Name new elements explicitly, gst names may already be taken by
+        # elements of a sink pipeline parsed from a plan
+        gst_wrapper.element_name_prefix = "flow%d_" % flow_id
+        infer_pipes = []
+        try:
+            model_obj = self.get_model_config(self.config["models"][model])
+            input_obj = config_parser.Input(self.config["inputs"][input])
+            input_obj.name = input
+            subflow_list = [[model_obj, [output_obj], [flow[3]]]]
+            flow_obj = config_parser.Flow(input_obj, subflow_list, self.debug_config)
+
+            # Add to running sink pipeline, new elements need to catch up
+            src_pipes, _ = gst_wrapper.get_gst_pipe(
+                [flow_obj], self.outputs, sink_player=self.sink_pipe
+            )
+            for e in self.sink_pipe.iterate_elements():
+                if e.get_name() not in state["elements"]:
+                    e.sync_state_with_parent()
+
+            self.gst_pipe.add_src(src_pipes[0], flow_obj)
+            for s in flow_obj.sub_flows:
+                infer_pipes.append(InferPipe(s, self.gst_pipe))
+        except BaseException:
+            self.rollback_attach(state, output_obj, flow_id, infer_pipes)
+            raise
+        finally:
+            gst_wrapper.element_name_prefix = None
+
+        self.gst_pipe.start_src(flow_obj.id)
+        for i in infer_pipes:
+            i.start()
+
+        self.flows.append(flow_obj)
+        self.flow_names[name] = flow_obj
+        self.infer_pipes += infer_pipes
+
+    def rollback_attach(self, state, output, flow_id, infer_pipes):
+        """
+        Undo a failed attach_flow: restore the counters and the output,
+        and remove what was added to the pipelines
+        Args:
+            state: state saved by attach_flow before the attach
+            output: Output object the flow was attached to
+            flow_id: id the attached flow was to get
+            infer_pipes: infer pipes constructed for the flow, not started
+        """
+        (
+            config_parser.Input.count,
+            config_parser.Flow.count,
+            config_parser.SubFlow.count,
+            config_parser.SubFlow.scaler_split_count,
+            EdgeAIDemo.C7_CORE_ID_INDEX,
+        ) = state["counters"]
+        (
+            num_subflows,
+            output.fps,
+            output.title_frame,
+            output.num_mosaic_sink,
+            output.mosaic_prop,
+        ) = state["output"]
+        del output.subflows[num_subflows:]
+        del utils.report_list[state["reports"] :]
+        del gst_wrapper.dynamic_links[state["dynamic_links"] :]
+
+        names = [
+            e.get_name()
+            for e in self.sink_pipe.iterate_elements()
+            if e.get_name() not in state["elements"]
+        ]
+        gst_wrapper.remove_elements(self.sink_pipe, names)
+        for i in infer_pipes:
+            if i.post_proc_pool:
+                i.post_proc_pool.close()
+        # src pipeline is never started before the attach succeeds
+        if len(self.gst_pipe.src_pipe) > flow_id:
+            self.gst_pipe.discard_src(flow_id)
+
+    def detach_flow(self, name):
+        """
+        Detach a flow from the running demo and release its input pipeline,
+        infer pipe and mosaic pad. Other flows keep running.
+        Raises ValueError if the flow can not be detached.
+        Args:
+            name: Name of the flow
+        """
+        if name not in self.flow_names:
+            raise ValueError("%s is not running" % name)
+        flow_obj = self.flow_names[name]
+        if list(self.flow_names.values()).count(flow_obj) > 1:
+            raise ValueError(
+                "%s shares its input with other flows, detach is not supported"
+                % name
+            )
+        for s in flow_obj.sub_flows:
+            if len(s.outputs) != 1 or not s.outputs[0].mosaic:
+                raise ValueError("%s is not displayed through mosaic" % name)
+
+        infer_pipes = [i for i in self.infer_pipes if i.sub_flow.flow == flow_obj]
+        for i in infer_pipes:
+            if i.broker:
+                raise ValueError("%s shares its model with other flows" % name)
+        for i in infer_pipes:
+            i.stop()
+        # Consumers see end of stream once input pipeline is stopped
+        self.gst_pipe.remove_src(flow_obj.id)
+        for i in infer_pipes:
+            i.wait_for_exit()
+            self.infer_pipes.remove(i)
+
+        for s in flow_obj.sub_flows:
+            output = s.outputs[0]
+            mosaic = output.gst_mosaic_elements[0]
+            appsrc = self.sink_pipe.get_by_name(s.gst_post_sink_name)
+            gst_wrapper.remove_sink_branch(self.sink_pipe, appsrc, mosaic)
+            output.subflows.remove(s)
+            utils.report_list.remove(s.report)
+
+        self.flows.remove(flow_obj)
+        del self.flow_names[name]
@@ -2,21 +2,589 @@ import gi
 
 gi.require_version("Gst", "1.0")
 gi.require_version("GstApp", "1.0")
-from gi.repository import Gst, GstApp, GLib, GObject
+gi.require_version("GstVideo", "1.0")
+from gi.repository import Gst, GstApp, GstVideo, GLib, GObject
 import numpy as np
 import os
 import sys
 import utils
 import time
-from threading import Lock
+import yaml
+import hashlib
+import heapq
+from threading import Event, Lock, Thread
+from queue import Queue, Empty, Full
+from fractions import Fraction
 from gst_element_map import gst_element_map
 
+# Formats of input pipelines probed on earlier runs
+FORMAT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "edgeai-gst-apps", "format_cache.yaml"
+)
+# Pipeline plans resolved on earlier runs
+PLAN_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "edgeai-gst-apps", "plans"
+)
+# Plans stored by an older layout of make_plan are resolved again
+PLAN_VERSION = 2
+# Clips decoded to raw NV12 frames for cache: sources
+CLIP_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "edgeai-gst-apps", "clips"
+)
+
+# (src element, sink element) names linked through sometimes pads
+dynamic_links = []
+
+# Prefix of names given to elements made by make_element, None to let gst
+# name them. Set while flows are attached to a running pipeline, so that
+# new elements do not collide with names parsed from a plan
+element_name_prefix = None
+element_name_count = 0
+
 Gst.init(None)
 
 preproc_target_idx = 0
 isp_target_idx = 0
 ldc_target_idx = 0
 
+class MappedArray(np.ndarray):
+    """
+    ndarray viewing the memory of a mapped Gst.Buffer. Holds a reference
+    to the BufferMapping so that the buffer stays mapped for as long as
+    the array or any view of it is alive. pts is the PTS of the buffer,
+    None if not set. timestamp is the clock time at which the source
+    buffer was captured, Gst.CLOCK_TIME_NONE if unknown.
+    """
+
+    def __array_finalize__(self, obj):
+        self.mapping = getattr(obj, "mapping", None)
+        self.pts = getattr(obj, "pts", None)
+        self.timestamp = getattr(obj, "timestamp", Gst.CLOCK_TIME_NONE)
+
+
+class BufferMapping:
+    """
+    Class to keep a Gst.Buffer mapped. The buffer is unmapped and released
+    when release() is called or when the last MappedArray using the
+    mapping is garbage collected.
+    """
+
+    def __init__(self, buffer, flags=Gst.MapFlags.READ, sample=None):
+        """
+        Constructor of BufferMapping class
+        Args:
+            buffer: Gst.Buffer to be mapped
+            flags: Gst.MapFlags used for mapping
+            sample: Gst.Sample holding the buffer, kept alive with the map
+        """
+        self.sample = sample
+        self.buffer = buffer
+        self.flags = flags
+        self.mapped, self.map_info = self.buffer.map(flags)
+
+    def get_array(self, shape, dtype, strides=None, offset=0):
+        """
+        Returns a MappedArray viewing the mapped memory without copying
+        Args:
+            shape: shape of the array
+            dtype: data type of the array
+            strides: strides of the array, None for contiguous
+            offset: offset of the array in the mapped memory
+        """
+        array = np.ndarray(
+            shape, dtype, self.map_info.data, offset=offset, strides=strides
+        )
+        array = array.view(MappedArray)
+        array.mapping = self
+        if self.buffer.pts != Gst.CLOCK_TIME_NONE:
+            array.pts = self.buffer.pts
+        return array
+
+    def release(self):
+        """
+        Unmap the buffer and release the sample
+        """
+        if self.mapped:
+            self.mapped = False
+            self.buffer.unmap(self.map_info)
+            self.map_info = None
+            self.buffer = None
+            self.sample = None
+
+    def __del__(self):
+        self.release()
+
+
+class OutputBufferPool:
+    """
+    Class to manage preallocated buffers of an appsrc. Buffers are exposed
+    as writable arrays so that frames can be drawn directly into them and
+    pushed without copying.
+    """
+
+    def __init__(self, caps, width, height):
+        """
+        Constructor of OutputBufferPool class
+        Args:
+            caps: caps of the appsrc
+            width: width of the RGB frame
+            height: height of the RGB frame
+        """
+        self.shape = (height, width, 3)
+        self.pool = Gst.BufferPool.new()
+        config = self.pool.get_config()
+        # Let the pool grow if downstream holds more buffers than minimum
+        Gst.BufferPool.config_set_params(config, caps, width * height * 3, 2, 0)
+        self.pool.set_config(config)
+        self.pool.set_active(True)
+
+    def acquire(self):
+        """
+        Returns a writable MappedArray backed by a buffer of the pool.
+        Raises RuntimeError if the pool is flushing or inactive
+        """
+        ret, buffer = self.pool.acquire_buffer(None)
+        if ret != Gst.FlowReturn.OK:
+            raise RuntimeError(
+                "Could not acquire output buffer: %s" % ret.value_nick
+            )
+        mapping = BufferMapping(buffer, Gst.MapFlags.WRITE)
+        mapping.pool = self
+        return mapping.get_array(self.shape, np.uint8)
+
+    def free(self):
+        """
+        Deactivate the pool
+        """
+        self.pool.set_active(False)
+
+
+def release_array(array):
+    """
+    Release the buffer mapping of a MappedArray. The array and its views
+    must not be used after this.
+    Args:
+        array: array returned by GstPipe.pull_frame or pull_tensor
+    """
+    mapping = getattr(array, "mapping", None)
+    if mapping:
+        mapping.release()
+
+
+def get_frame_descriptor(caps):
+    """
+    Returns (shape, dtype, strides, offset) of RGB frames with given caps,
+    None if the caps do not describe a raw video frame. Row stride and
+    offset are taken from the video info, so padded rows are viewed
+    without copying
+    Args:
+        caps: Gst.Caps negotiated on an appsink
+    """
+    if caps.get_structure(0).get_name() != "video/x-raw":
+        return None
+    info = GstVideo.VideoInfo.new_from_caps(caps)
+    if info == None:
+        return None
+    shape = (info.height, info.width, 3)
+    return shape, np.uint8, (info.stride[0], 3, 1), info.offset[0]
+
+
+class AppSinkQueue:
+    """
+    Class to receive the samples of an appsink through its new-sample
+    signal. Samples are queued from the streaming thread so that consumers
+    block on the queue and wake up as soon as a sample arrives, instead of
+    polling the appsink. The frame descriptor (shape, dtype, strides,
+    offset) is derived once per caps event and queued along with the
+    samples, so consumers need not query the caps of every sample.
+    """
+
+    def __init__(self, appsink):
+        """
+        Constructor of AppSinkQueue class
+        Args:
+            appsink: GstAppSink element whose samples are queued
+        """
+        self.appsink = appsink
+        # Queue takes over max-buffers and drop from the appsink since
+        # samples are pulled out of it as soon as they arrive
+        self.drop = appsink.get_property("drop")
+        self.queue = Queue(max(1, appsink.get_property("max-buffers")))
+        # Set before the pipeline is stopped, so that a streaming thread
+        # waiting for room in the queue gives up
+        self.flushing = False
+        # Descriptor of the caps currently negotiated on the appsink
+        self.caps_descriptor = None
+        appsink.get_static_pad("sink").add_probe(
+            Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_event
+        )
+        appsink.set_property("emit-signals", True)
+        appsink.connect("new-sample", self.on_new_sample)
+        appsink.connect("eos", self.on_eos)
+
+    def on_event(self, pad, info):
+        """
+        Pad probe on appsink sink pad, re-derives the descriptor on caps event
+        """
+        event = info.get_event()
+        if event.type == Gst.EventType.CAPS:
+            self.caps_descriptor = get_frame_descriptor(event.parse_caps())
+        return Gst.PadProbeReturn.OK
+
+    def on_new_sample(self, appsink):
+        """
+        Callback of new-sample signal, called from the streaming thread
+        """
+        sample = appsink.pull_sample()
+        if sample == None:
+            return Gst.FlowReturn.OK
+        # Caps events are serialized with buffers, hence caps_descriptor
+        # always belongs to this sample
+        item = (sample, self.caps_descriptor)
+        if self.drop:
+            # Make room by dropping the oldest sample
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except Full:
+                    try:
+                        self.queue.get_nowait()
+                    except Empty:
+                        pass
+        else:
+            # Wait for room, unless the pipeline is being stopped
+            while True:
+                if self.flushing:
+                    return Gst.FlowReturn.FLUSHING
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except Full:
+                    pass
+        return Gst.FlowReturn.OK
+
+    def on_eos(self, appsink):
+        """
+        Callback of eos signal. None is queued to mark the end of stream,
+        dropping the oldest sample if the queue is full
+        """
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                break
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                except Empty:
+                    pass
+
+    def set_flushing(self, flushing):
+        """
+        Set the queue flushing before stopping the pipeline, so that the
+        streaming thread does not block on a full queue. Unset it once the
+        pipeline is started again
+        Args:
+            flushing: True to refuse samples which do not fit the queue
+        """
+        self.flushing = flushing
+
+    def get(self, timeout=None):
+        """
+        Returns the next (sample, descriptor), None on end of stream.
+        Raises Empty if no sample arrived with in timeout seconds.
+        Args:
+            timeout: Max time to wait in seconds, None to wait forever
+        """
+        return self.queue.get(timeout=timeout)
+
+
+class LoopController:
+    """
+    Class to loop a src pipeline without stalls. The pipeline is played
+    with a segment seek, so that it posts SEGMENT_DONE instead of going
+    EOS at the end of the file, and a non flushing seek to the start is
+    issued when SourceSupervisor sees SEGMENT_DONE on the bus of the
+    pipeline. Each looped pipeline has its own controller.
+    """
+
+    def __init__(self, pipeline):
+        """
+        Constructor of LoopController class
+        Args:
+            pipeline: Gst Pipeline of the source to be looped
+        """
+        self.pipeline = pipeline
+
+    def seek(self, flags):
+        """
+        Seek the pipeline to the start as a segment seek
+        Args:
+            flags: Gst.SeekFlags used along with SEGMENT
+        """
+        return self.pipeline.seek(
+            1.0,
+            Gst.Format.TIME,
+            flags | Gst.SeekFlags.SEGMENT,
+            Gst.SeekType.SET,
+            0,
+            Gst.SeekType.NONE,
+            Gst.CLOCK_TIME_NONE,
+        )
+
+    def start(self):
+        """
+        Start looping. To be called once the pipeline is PAUSED. If the
+        pipeline is not seekable in time, EOS is handled by
+        GstPipe.pull_sample
+        """
+        self.seek(Gst.SeekFlags.FLUSH)
+
+    def on_segment_done(self):
+        """
+        Seek back to the start without flushing
+        """
+        self.seek(Gst.SeekFlags.NONE)
+
+
+class SourceSupervisor:
+    """
+    Class to watch the bus of every src pipeline from a single thread.
+    Network sources which post an error or EOS are restarted with
+    exponential backoff while other pipelines keep running. The time
+    taken to reconnect and the frames lost are reported to the subflows
+    of the source.
+    """
+
+    MIN_BACKOFF = 0.5
+    MAX_BACKOFF = 30
+
+    def __init__(self, src_pipe, flows, loop_controllers, set_flushing):
+        """
+        Constructor of SourceSupervisor class
+        Args:
+            src_pipe: list of gst pipeline for src (input)
+            flows: list of flows of the src pipelines
+            loop_controllers: dictionary of src index to its LoopController
+            set_flushing: function(index, flushing) to set sample queues
+                          of a src pipeline flushing around its restart
+        """
+        self.src_pipe = src_pipe
+        self.set_flushing = set_flushing
+        self.flows = list(flows)
+        self.loop_controllers = loop_controllers
+        self.reconnect = set()
+        for index, f in enumerate(flows):
+            if str(f.input.source).startswith(("rtsp", "http")):
+                self.reconnect.add(index)
+        # src index to its bus being watched
+        self.buses = {}
+        # src index to (time of failure, backoff in seconds)
+        self.failures = {}
+        # failed src indexes restarted successfully
+        self.restarted = set()
+        self.stopped = False
+        self.mutex = Lock()
+        self.context = GLib.MainContext.new()
+        self.main_loop = GLib.MainLoop.new(self.context, False)
+        self.thread = None
+
+    def start(self):
+        """
+        Start watching the buses
+        """
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """
+        Run the main loop dispatching bus messages of all src pipelines
+        """
+        # Bus watches attach to the thread default context
+        self.context.push_thread_default()
+        for index in range(len(self.flows)):
+            self.watch(index)
+        self.main_loop.run()
+        for bus in self.buses.values():
+            bus.remove_signal_watch()
+        self.buses.clear()
+        self.context.pop_thread_default()
+
+    def watch(self, index):
+        """
+        Start watching the bus of a src pipeline, called from the
+        supervisor thread
+        """
+        bus = self.src_pipe[index].get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.on_message, index)
+        self.buses[index] = bus
+        return False
+
+    def unwatch(self, index):
+        """
+        Stop watching the bus of a src pipeline, called from the
+        supervisor thread
+        """
+        if index in self.buses:
+            self.buses.pop(index).remove_signal_watch()
+        return False
+
+    def invoke(self, function, index):
+        """
+        Run function(index) in the supervisor thread
+        """
+        source = GLib.idle_source_new()
+        source.set_callback(function, index)
+        source.attach(self.context)
+
+    def add(self, flow):
+        """
+        Supervise the src pipeline of a flow attached at runtime. The
+        pipeline must already be added to src_pipe at flow.id
+        Args:
+            flow: flow of the src pipeline
+        """
+        self.flows.append(flow)
+        if str(flow.input.source).startswith(("rtsp", "http")):
+            self.reconnect.add(flow.id)
+        if self.thread:
+            self.invoke(self.watch, flow.id)
+
+    def remove(self, index):
+        """
+        Stop supervising a src pipeline detached at runtime
+        Args:
+            index: index of the src pipeline
+        """
+        with self.mutex:
+            self.reconnect.discard(index)
+            self.failures.pop(index, None)
+            self.restarted.discard(index)
+        if self.thread:
+            self.invoke(self.unwatch, index)
+
+    def on_message(self, bus, msg, index):
+        """
+        Bus message callback, called from the supervisor thread
+        """
+        if msg.type == Gst.MessageType.SEGMENT_DONE:
+            if index in self.loop_controllers:
+                self.loop_controllers[index].on_segment_done()
+        elif msg.type in (Gst.MessageType.ERROR, Gst.MessageType.EOS):
+            if msg.type == Gst.MessageType.ERROR:
+                err, debug_info = msg.parse_error()
+                print("[ERROR]", err.message)
+            if index in self.reconnect and not self.stopped:
+                with self.mutex:
+                    if index not in self.failures:
+                        self.failures[index] = (time.time(), self.MIN_BACKOFF)
+                        self.schedule_restart(index)
+
+    def schedule_restart(self, index):
+        """
+        Restart the src pipeline after its current backoff
+        """
+        backoff = self.failures[index][1]
+        print(
+            "[WARNING] Input %s lost, reconnecting in %.1f s"
+            % (self.flows[index].input.source, backoff)
+        )
+        source = GLib.timeout_source_new(int(backoff * 1000))
+        source.set_callback(self.restart, index)
+        source.attach(self.context)
+
+    def restart(self, index):
+        """
+        Rebuild the state of a src pipeline. Other pipelines keep running
+        """
+        if self.stopped or index not in self.reconnect:
+            return False
+        pipeline = self.src_pipe[index]
+        self.set_flushing(index, True)
+        pipeline.set_state(Gst.State.NULL)
+        self.set_flushing(index, False)
+        ret = pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            with self.mutex:
+                failed_at, backoff = self.failures[index]
+                self.failures[index] = (
+                    failed_at,
+                    min(backoff * 2, self.MAX_BACKOFF),
+                )
+                self.schedule_restart(index)
+        else:
+            # Samples queued before the failure do not mark the recovery
+            self.restarted.add(index)
+        return False
+
+    def is_supervised(self, index):
+        """
+        Returns True if the src pipeline is restarted on failures
+        """
+        return index in self.reconnect and not self.stopped
+
+    def keep_waiting(self, index, waited):
+        """
+        Returns True if consumers of a supervised src pipeline should keep
+        waiting for samples. Sources which fail to deliver samples for
+        reconnect-timeout are given up and no longer supervised.
+        Args:
+            index: index of the src pipeline
+            waited: seconds the consumer has waited for a sample
+        """
+        timeout = self.flows[index].input.reconnect_timeout
+        if timeout <= 0:
+            return True
+        with self.mutex:
+            failure = self.failures.get(index)
+            if failure:
+                waited = time.time() - failure[0]
+            if waited < timeout:
+                return True
+            if index in self.reconnect:
+                print(
+                    "[ERROR] Input %s did not recover in %d s, giving up"
+                    % (self.flows[index].input.source, timeout)
+                )
+                self.reconnect.discard(index)
+                self.failures.pop(index, None)
+                self.restarted.discard(index)
+        return False
+
+    def on_sample(self, index):
+        """
+        To be called when a sample is pulled from the src pipeline.
+        Reports the reconnect time and frames lost if it was recovering
+        """
+        if index not in self.restarted:
+            return
+        with self.mutex:
+            if index not in self.restarted:
+                return
+            self.restarted.discard(index)
+            failed_at, backoff = self.failures.pop(index)
+        reconnect_time = time.time() - failed_at
+        input = self.flows[index].input
+        frames_lost = int(reconnect_time * float(Fraction(str(input.fps))))
+        print(
+            "[INFO] Input %s reconnected in %.1f s" % (input.source, reconnect_time)
+        )
+        for s in self.flows[index].sub_flows:
+            s.report.report_count("reconnects", unit="")
+            s.report.report_proctime("reconnect time", reconnect_time)
+            s.report.report_count("frames lost", frames_lost)
+
+    def stop(self):
+        """
+        Stop reconnecting and watching the buses
+        """
+        self.stopped = True
+        self.main_loop.quit()
+        if self.thread:
+            self.thread.join()
+
+
 class GstPipe:
     """
     Class to handle gstreamer pipeline related things
@@ -24,43 +592,194 @@ class GstPipe:
     to gst pipeline
     """
 
-    def __init__(self, src_pipe, sink_pipe):
+    # Number of frames over which the latency of an appsrc is measured
+    # before it is allowed to come down
+    LATENCY_WINDOW = 150
+
+    def __init__(self, src_pipe, sink_pipe, flows=None):
         """
         Create a gst pipeline using gst launch string
         Args:
             src_pipe: list of gst pipeline for src (input)
             sink_pipe: gst pipeline for sink (output)
+            flows: list of flows of src pipelines, used to loop and
+                   supervise the sources
         """
         self.src_pipe = src_pipe
         self.sink_pipe = sink_pipe
         self.mutex = Lock()
+        self.loop_controllers = {}
+        self.supervisor = None
+        # appsink name to index of its src pipeline
+        self.src_index = {}
+        # indexes of src pipelines detached at runtime
+        self.removed_src = set()
+        if flows:
+            for index, f in enumerate(flows):
+                if f.input.loop:
+                    self.loop_controllers[index] = LoopController(src_pipe[index])
+            self.supervisor = SourceSupervisor(
+                src_pipe, flows, self.loop_controllers, self.set_src_flushing
+            )
+        self.buffer_pools = {}
+        self.sample_queues = {}
+        self.durations = {}
+        # appsrc name to [reported latency, max latency in window, frames
+        # in window]
+        self.latencies = {}
+        # Set on LATENCY message of sink pipeline, handled by latency thread
+        self.latency_changed = Event()
+        self.latency_thread = None
+        self.stopped = False
+        if sink_pipe != None:
+            sink_pipe.get_bus().set_sync_handler(self.on_sink_message)
+
+    def on_sink_message(self, bus, msg):
+        """
+        Sync handler of the sink pipeline bus, called from the thread
+        posting the message. Latency is recalculated from the latency
+        thread since it must not be done from a streaming thread. All
+        messages are passed on to the bus.
+        """
+        if msg.type == Gst.MessageType.LATENCY:
+            self.latency_changed.set()
+        return Gst.BusSyncReply.PASS
+
+    def recalculate_latency(self):
+        """
+        Callback function for latency thread. Redistributes the latency
+        of the sink pipeline when an element posts a LATENCY message, so
+        that live aggregators like mosaic and the sinks account for it
+        """
+        while not self.stopped:
+            if not self.latency_changed.wait(0.5):
+                continue
+            self.latency_changed.clear()
+            if not self.stopped:
+                self.sink_pipe.recalculate_latency()
 
     def start(self):
         """
         Start the gst pipeline
         """
-        ret = self.sink_pipe.set_state(Gst.State.PLAYING)
+        if self.sink_pipe != None:
+            self.latency_thread = Thread(target=self.recalculate_latency, daemon=True)
+            self.latency_thread.start()
+        # There is no sink pipeline if all the outputs are metadata
+        if self.sink_pipe != None:
+            ret = self.sink_pipe.set_state(Gst.State.PLAYING)
+            if ret == Gst.StateChangeReturn.FAILURE:
+                bus = self.sink_pipe.get_bus()
+                msg = bus.timed_pop_filtered(
+                    Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR
+                )
+                err, debug_info = msg.parse_error()
+                print("[ERROR]", err.message)
+                sys.exit(1)
+
+        for index in range(len(self.src_pipe)):
+            self.start_src(index)
+
+        if self.supervisor:
+            self.supervisor.start()
+
+    def start_src(self, index):
+        """
+        Start a src pipeline
+        Args:
+            index: index of the src pipeline
+        """
+        src = self.src_pipe[index]
+        # Looped pipelines need to be PAUSED for the initial segment seek
+        if index in self.loop_controllers:
+            src.set_state(Gst.State.PAUSED)
+            src.get_state(5 * Gst.SECOND)
+            self.loop_controllers[index].start()
+
+        ret = src.set_state(Gst.State.PLAYING)
         if ret == Gst.StateChangeReturn.FAILURE:
-            bus = self.sink_pipe.get_bus()
+            bus = src.get_bus()
             msg = bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR)
             err, debug_info = msg.parse_error()
             print("[ERROR]", err.message)
             sys.exit(1)
 
-        for src in self.src_pipe:
-            ret = src.set_state(Gst.State.PLAYING)
-            if ret == Gst.StateChangeReturn.FAILURE:
-                bus = src.get_bus()
-                msg = bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR)
-                err, debug_info = msg.parse_error()
-                print("[ERROR]", err.message)
-                sys.exit(1)
+    def add_src(self, pipeline, flow):
+        """
+        Add the src pipeline of a flow attached at runtime. It is to be
+        started with start_src once its appsinks are taken with get_src
+        Args:
+            pipeline: gst pipeline of the flow
+            flow: flow attached
+        """
+        self.src_pipe.append(pipeline)
+        if flow.input.loop:
+            self.loop_controllers[flow.id] = LoopController(pipeline)
+        if self.supervisor:
+            self.supervisor.add(flow)
+
+    def discard_src(self, index):
+        """
+        Undo add_src of a flow whose attach failed before its pipeline was
+        started. Only the last added pipeline can be discarded
+        Args:
+            index: index of the src pipeline
+        """
+        if self.supervisor:
+            self.supervisor.remove(index)
+            self.supervisor.flows.pop(index)
+        self.loop_controllers.pop(index, None)
+        for name in [n for n, i in self.src_index.items() if i == index]:
+            del self.src_index[name]
+            self.sample_queues.pop(name, None)
+        self.src_pipe.pop(index).set_state(Gst.State.NULL)
+
+    def remove_src(self, index):
+        """
+        Stop the src pipeline of a flow detached at runtime. Consumers of
+        its appsinks see end of stream. The pipeline is left in src_pipe
+        so that indexes of other pipelines do not change.
+        Args:
+            index: index of the src pipeline
+        """
+        if self.supervisor:
+            self.supervisor.remove(index)
+        self.loop_controllers.pop(index, None)
+        self.removed_src.add(index)
+        self.set_src_flushing(index, True)
+        self.src_pipe[index].set_state(Gst.State.NULL)
+        for name, src_index in self.src_index.items():
+            if src_index == index:
+                self.sample_queues[name].on_eos(None)
+
+    def set_src_flushing(self, index, flushing):
+        """
+        Set the sample queues of the appsinks of a src pipeline flushing
+        Args:
+            index: index of the src pipeline
+            flushing: True before stopping the pipeline, False after
+                      starting it again
+        """
+        for name, src_index in self.src_index.items():
+            if src_index == index:
+                self.sample_queues[name].set_flushing(flushing)
+
+    def stop_reconnecting(self):
+        """
+        Stop restarting failed sources so that consumers see their end
+        """
+        if self.supervisor:
+            self.supervisor.stop()
 
     def get_src(self, name, flow_id):
         """
         get the gst src element by name
         """
-        return self.src_pipe[flow_id].get_by_name(name)
+        src = self.src_pipe[flow_id].get_by_name(name)
+        self.src_index[name] = flow_id
+        if name not in self.sample_queues:
+            self.sample_queues[name] = AppSinkQueue(src)
+        return src
 
     def get_sink(self, name, width, height, fps):
         """
@@ -75,40 +794,158 @@ class GstPipe:
         )
         sink = self.sink_pipe.get_by_name(name)
         sink.set_caps(caps)
+        self.buffer_pools[name] = OutputBufferPool(caps, width, height)
+        fps = Fraction(str(fps))
+        if fps > 0:
+            self.durations[name] = Gst.SECOND * fps.denominator // fps.numerator
+        else:
+            self.durations[name] = Gst.CLOCK_TIME_NONE
+        self.latencies[name] = [0, 0, 0]
         return sink
 
-    def pull_frame(self, src, loop):
+    def get_output_frame(self, sink):
         """
-        Pull a frame from gst pipeline
+        Returns a writable frame backed by a pooled buffer of the sink.
+        Frames drawn into it are pushed without copying.
         Args:
-            src: gst src element from which the frame is pulled
+            sink: gst sink element to which the frame will be pushed
+        """
+        return self.buffer_pools[sink.get_name()].acquire()
+
+    def pull_sample(self, src, loop):
+        """
+        Pull a sample from gst pipeline. Returns (sample, descriptor) where
+        descriptor is the frame descriptor of the caps the sample was
+        negotiated with, None at the end of stream
+        Args:
+            src: gst src element from which the sample is pulled
             loop: If src need to be looped after eos
         """
-        sample = src.try_pull_sample(5000000000)
-        if type(sample) != Gst.Sample:
-            if src.is_eos():
-                if loop:
-                    # Seek can be called from various sources hence putting lock
-                    with self.mutex:
-                        src.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, 0)
-                        sample = src.try_pull_sample(5000000000)
-                else:
+        sample_queue = self.sample_queues[src.get_name()]
+        index = self.src_index.get(src.get_name())
+        supervisor = self.supervisor
+        waited = 0
+        while True:
+            supervised = supervisor and supervisor.is_supervised(index)
+            try:
+                item = sample_queue.get(5)
+            except Empty:
+                waited += 5
+                if supervised and supervisor.keep_waiting(index, waited):
+                    # Wait for supervised sources till they reconnect
+                    continue
+                print("[ERROR] Error pulling sample from GST Pipeline")
+                return None
+            if supervised:
+                if item == None:
+                    continue
+                supervisor.on_sample(index)
+            break
+
+        if item == None:
+            if index in self.removed_src:
+                # Detached, do not loop
+                sample_queue.on_eos(src)
+            elif loop:
+                # Only reached by sources not seekable by LoopController.
+                # Seek can be called from various sources hence putting lock
+                with self.mutex:
+                    src.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, 0)
+                try:
+                    item = sample_queue.get(5)
+                except Empty:
+                    print("[ERROR] Error pulling sample from GST Pipeline")
                     return None
             else:
-                print("[ERROR] Error pulling frame from GST Pipeline")
-                return None
-        caps = sample.get_caps()
+                # Keep the end of stream for other consumers of src
+                sample_queue.on_eos(src)
+        return item
 
-        struct = caps.get_structure(0)
-        width = struct.get_value("width")
-        height = struct.get_value("height")
+    def get_latency(self, src, sample):
+        """
+        Returns how old the sample is, in ns, by comparing its PTS with
+        the running time of the pipeline clock. Returns 0 if the age
+        can not be determined.
+        Args:
+            src: gst src element from which the sample is pulled
+            sample: Gst.Sample pulled from src
+        """
+        pts = sample.get_buffer().pts
+        clock = src.get_clock()
+        if pts == Gst.CLOCK_TIME_NONE or clock == None:
+            return 0
+        running_time = sample.get_segment().to_running_time(Gst.Format.TIME, pts)
+        if running_time == Gst.CLOCK_TIME_NONE:
+            return 0
+        return clock.get_time() - src.get_base_time() - running_time
+
+    def get_clock_time(self, src, sample):
+        """
+        Returns the clock time at which the sample was captured, computed
+        from its PTS and the base time of the src pipeline. Returns
+        Gst.CLOCK_TIME_NONE if it can not be determined.
+        Args:
+            src: gst src element from which the sample is pulled
+            sample: Gst.Sample pulled from src
+        """
+        pts = sample.get_buffer().pts
+        if pts == Gst.CLOCK_TIME_NONE:
+            return Gst.CLOCK_TIME_NONE
+        running_time = sample.get_segment().to_running_time(Gst.Format.TIME, pts)
+        if running_time == Gst.CLOCK_TIME_NONE:
+            return Gst.CLOCK_TIME_NONE
+        return src.get_base_time() + running_time
+
+    def frame_from_sample(self, sample, src=None, descriptor=None):
+        """
+        Convert a sample pulled from sensor path to a frame. The frame
+        views the buffer memory, which stays mapped till the frame is
+        garbage collected or released with release_array.
+        Args:
+            sample: Gst.Sample holding a RGB frame
+            src: gst src element the sample was pulled from
+            descriptor: frame descriptor pulled along with the sample,
+                        the caps of the sample are queried if None
+        """
+        if descriptor == None:
+            descriptor = get_frame_descriptor(sample.get_caps())
+
+        shape, dtype, strides, offset = descriptor
+        mapping = BufferMapping(sample.get_buffer(), sample=sample)
+        frame = mapping.get_array(shape, dtype, strides, offset)
+        if src != None:
+            frame.timestamp = self.get_clock_time(src, sample)
+        return frame
 
-        buffer = sample.get_buffer()
-        _, map_info = buffer.map(Gst.MapFlags.READ)
-        frame = np.ndarray((height, width, 3), np.uint8, map_info.data)
-        buffer.unmap(map_info)
+    def tensor_from_sample(self, sample, width, height, layout, data_type):
+        """
+        Convert a sample pulled from dl path to a tensor. Like frames,
+        the tensor views the buffer memory without copying.
+        Args:
+            sample: Gst.Sample holding the pre-processed tensor
+            width: width of the tensor
+            height: height of the tensor
+            layout: data layout (NHWC or NCHW)
+            data_type: data type of the tensor
+        """
+        mapping = BufferMapping(sample.get_buffer(), sample=sample)
+        if layout == "NHWC":
+            return mapping.get_array((1, height, width, 3), data_type)
+        elif layout == "NCHW":
+            return mapping.get_array((1, 3, height, width), data_type)
 
-        return frame
+    def pull_frame(self, src, loop):
+        """
+        Pull a frame from gst pipeline
+        Args:
+            src: gst src element from which the frame is pulled
+            loop: If src need to be looped after eos
+        """
+        item = self.pull_sample(src, loop)
+        if item == None:
+            return None
+        sample, descriptor = item
+        return self.frame_from_sample(sample, src, descriptor)
 
     def pull_tensor(self, src, loop, width, height, layout, data_type):
         """
@@ -121,39 +958,77 @@ class GstPipe:
             layout: data layout (NHWC or NCHW)
             data_type: data type of the tensor
         """
-        sample = src.try_pull_sample(5000000000)
-        if type(sample) != Gst.Sample:
-            if src.is_eos():
-                if loop:
-                    # Seek can be called from various sources hence putting lock
-                    with self.mutex:
-                        src.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, 0)
-                        sample = src.try_pull_sample(5000000000)
-                else:
-                    return None
-            else:
-                print("[ERROR] Error pulling tensor from GST Pipeline")
-                return None
-        buffer = sample.get_buffer()
-        _, map_info = buffer.map(Gst.MapFlags.READ)
-        if layout == "NHWC":
-            frame = np.ndarray((1, height, width, 3), data_type, map_info.data)
-        elif layout == "NCHW":
-            frame = np.ndarray((1, 3, height, width), data_type, map_info.data)
-        buffer.unmap(map_info)
-
-        return frame
+        item = self.pull_sample(src, loop)
+        if item == None:
+            return None
+        sample, _ = item
+        return self.tensor_from_sample(sample, width, height, layout, data_type)
 
-    def push_frame(self, frame, sink):
+    def push_frame(self, frame, sink, timestamp=None):
         """
-        Push a frame from gst pipeline
+        Push a frame from gst pipeline. The buffer is stamped with the
+        capture time of the source frame, converted to the running time
+        of the sink pipeline, so that latency is accounted end to end.
         Args:
             frame: output frame to be pushed
             sink: gst sink element to which the frame is pushed
+            timestamp: clock time at which the source frame was captured.
+                       Taken from the frame if None
         """
-        buffer = Gst.Buffer.new_wrapped(frame.tobytes())
+        name = sink.get_name()
+        pool = self.buffer_pools[name]
+        if timestamp == None:
+            timestamp = getattr(frame, "timestamp", Gst.CLOCK_TIME_NONE)
+        mapping = getattr(frame, "mapping", None)
+        if mapping == None or getattr(mapping, "pool", None) != pool:
+            # Copy to a pooled buffer if frame is not drawn into one
+            out_frame = pool.acquire()
+            np.copyto(out_frame, frame)
+            mapping = out_frame.mapping
+        buffer = mapping.buffer
+        mapping.release()
+
+        clock = self.sink_pipe.get_clock()
+        if clock != None:
+            base_time = self.sink_pipe.get_base_time()
+            now = clock.get_time()
+            if timestamp == Gst.CLOCK_TIME_NONE or timestamp > now:
+                timestamp = now
+            buffer.pts = max(timestamp - base_time, 0)
+            buffer.dts = Gst.CLOCK_TIME_NONE
+            buffer.duration = self.durations[name]
+            self.update_latency(sink, now - timestamp)
         sink.push_buffer(buffer)
 
+    def update_latency(self, sink, latency):
+        """
+        Update the latency reported by the sink and ask the sink pipeline
+        to redistribute it. The latency is raised as soon as a frame is
+        pushed later than before after capture, and brought down to the
+        max latency of the last LATENCY_WINDOW frames otherwise
+        Args:
+            sink: gst appsrc element
+            latency: time between capture and push of a frame, in ns
+        """
+        name = sink.get_name()
+        entry = self.latencies[name]
+        entry[1] = max(entry[1], latency)
+        entry[2] += 1
+        if latency <= entry[0]:
+            if entry[2] < GstPipe.LATENCY_WINDOW:
+                return
+            latency = entry[1]
+            entry[1], entry[2] = 0, 0
+        # Round up to a frame to avoid a latency message for every frame
+        duration = self.durations[name]
+        if duration != Gst.CLOCK_TIME_NONE and duration > 0:
+            latency = (latency + duration - 1) // duration * duration
+        if latency == entry[0]:
+            return
+        entry[0] = latency
+        sink.set_property("min-latency", latency)
+        sink.post_message(Gst.Message.new_latency(sink))
+
     def send_eos(self, sink):
         """
         Send EOS singnal to the sink
@@ -167,17 +1042,117 @@ class GstPipe:
         Free the gst pipeline
         """
         # wait for EOS in sink pipeline
-        bus = self.sink_pipe.get_bus()
-        msg = bus.timed_pop_filtered(
-            Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS
-        )
-        if msg:
-            if msg.type == Gst.MessageType.ERROR:
-                err, debug_info = msg.parse_error()
-                print("[ERROR]", err.message)
-        self.sink_pipe.set_state(Gst.State.NULL)
+        if self.sink_pipe != None:
+            bus = self.sink_pipe.get_bus()
+            msg = bus.timed_pop_filtered(
+                Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS
+            )
+            if msg:
+                if msg.type == Gst.MessageType.ERROR:
+                    err, debug_info = msg.parse_error()
+                    print("[ERROR]", err.message)
+        self.stop_reconnecting()
+        self.stopped = True
+        if self.latency_thread:
+            self.latency_thread.join()
+        if self.sink_pipe != None:
+            self.sink_pipe.set_state(Gst.State.NULL)
+        for sample_queue in self.sample_queues.values():
+            sample_queue.set_flushing(True)
         for src in self.src_pipe:
             src.set_state(Gst.State.NULL)
+        for pool in self.buffer_pools.values():
+            pool.free()
+
+
+class SamplePairer:
+    """
+    Class to pair the samples of dl path and sensor path of a subflow
+    by their buffer PTS. Samples which do not find their pair with in
+    the reorder window are dropped.
+    """
+
+    def __init__(self, gst_pipe, tensor_src, frame_src, loop, window, report):
+        """
+        Constructor of SamplePairer class
+        Args:
+            gst_pipe: GstPipe object used to pull the samples
+            tensor_src: appsink of dl path
+            frame_src: appsink of sensor path
+            loop: If src need to be looped after eos
+            window: Max number of unmatched samples held per appsink
+            report: utils.Report object of the subflow
+        """
+        self.gst_pipe = gst_pipe
+        self.srcs = (tensor_src, frame_src)
+        self.loop = loop
+        self.window = window
+        self.report = report
+        self.pending = ([], [])
+
+    def match(self):
+        """
+        Return the oldest matching pair from pending samples if any.
+        Unmatched samples older than the returned pair are dropped.
+        """
+        tensors, frames = self.pending
+        for t_index, (t_pts, t_item) in enumerate(tensors):
+            for f_index, (f_pts, f_item) in enumerate(frames):
+                if (
+                    t_pts == Gst.CLOCK_TIME_NONE
+                    or f_pts == Gst.CLOCK_TIME_NONE
+                    or abs(t_pts - f_pts) < Gst.MSECOND
+                ):
+                    dropped = t_index + f_index
+                    del tensors[: t_index + 1]
+                    del frames[: f_index + 1]
+                    if dropped:
+                        self.report.report_count("unmatched drops", dropped)
+                    self.report.report_count("matched frames")
+                    return t_item, f_item
+        return None
+
+    def get_behind(self):
+        """
+        Returns the index of the appsink to pull from, the one whose
+        newest pending sample has the older PTS. An appsink without
+        pending samples or without PTS is pulled by pending count.
+        """
+        tensors, frames = self.pending
+        if len(tensors) == 0 or len(frames) == 0:
+            return 0 if len(tensors) == 0 else 1
+        t_pts = tensors[-1][0]
+        f_pts = frames[-1][0]
+        if t_pts == Gst.CLOCK_TIME_NONE or f_pts == Gst.CLOCK_TIME_NONE:
+            return 0 if len(tensors) <= len(frames) else 1
+        return 0 if t_pts <= f_pts else 1
+
+    def pull(self):
+        """
+        Pull a pair of (sample, descriptor) of dl path and sensor path with
+        matching PTS. Descriptors travel with their samples, since samples
+        are pulled out of order. Returns None if any of the appsink reached
+        end of stream.
+        """
+        while True:
+            pair = self.match()
+            if pair != None:
+                return pair
+
+            # Pull from the appsink whose newest sample is behind in PTS,
+            # pulling by pending count keeps pulling the side running ahead
+            index = self.get_behind()
+            item = self.gst_pipe.pull_sample(self.srcs[index], self.loop)
+            if item == None:
+                return None
+            pts = item[0].get_buffer().pts
+            self.pending[index].append((pts, item))
+
+            # Drop oldest sample if it could not be matched with in window
+            for pending in self.pending:
+                if len(pending) > self.window:
+                    del pending[0]
+                    self.report.report_count("unmatched drops")
 
 
 def dump_dot_file(data, prefix):
@@ -234,6 +1209,43 @@ def get_caps(element, pad_name):
     return caps
 
 
+# Capabilities of element factories, filled lazily by get_factory_info
+factory_registry = {}
+
+
+def get_factory_info(element_factory):
+    """
+    Returns the capabilities of an element factory. Pad templates are
+    introspected only on the first call for a factory, later calls are
+    answered from factory_registry. Formats and pad counts are added
+    to it on first use by get_pad_format and get_num_pads
+    Args:
+        element_factory: GstElementFactory
+    """
+    name = element_factory.get_name()
+    if name in factory_registry:
+        return factory_registry[name]
+
+    info = {"src": {}, "sink": {}, "num_pads": {}}
+    # First template of each direction is used as done earlier
+    for pad in element_factory.get_static_pad_templates():
+        if pad.direction == Gst.PadDirection.SRC:
+            direction = "src"
+        elif pad.direction == Gst.PadDirection.SINK:
+            direction = "sink"
+        else:
+            continue
+        if info[direction]:
+            continue
+        padtemplate = pad.get()
+        info[direction] = {
+            "caps": padtemplate.get_caps(),
+            "presence": padtemplate.presence,
+        }
+    factory_registry[name] = info
+    return info
+
+
 def get_pad_info(element_factory, pad_name, info_type):
     """
     Returns info about a pad
@@ -242,22 +1254,10 @@ def get_pad_info(element_factory, pad_name, info_type):
         pad_name: GstPad
         info_type: "caps" or "presence"
     """
-    pads = element_factory.get_static_pad_templates()
-    for pad in pads:
-        padtemplate = pad.get()
-
-        if pad.direction == Gst.PadDirection.SRC and pad_name == "src":
-            if info_type == "caps":
-                return padtemplate.get_caps()
-            elif info_type == "presence":
-                return padtemplate.presence
-
-        elif pad.direction == Gst.PadDirection.SINK and pad_name == "sink":
-            if info_type == "caps":
-                return padtemplate.get_caps()
-            elif info_type == "presence":
-                return padtemplate.presence
-    return None
+    info = get_factory_info(element_factory)
+    if pad_name not in ("src", "sink"):
+        return None
+    return info[pad_name].get(info_type)
 
 
 def get_pad_format(element_factory, pad_name):
@@ -267,14 +1267,19 @@ def get_pad_format(element_factory, pad_name):
         element_factory: GstElementFactory
         pad_name: GstPad
     """
-    data = []
-    caps = get_pad_info(element_factory, pad_name, "caps")
-    if caps.is_any():
+    info = get_factory_info(element_factory)[pad_name]
+    if "formats" not in info:
+        caps = info["caps"]
+        if caps.is_any():
+            info["formats"] = 1
+        else:
+            info["formats"] = []
+            prop_list = caps.get_structure(0).get_list("format").array
+            for i in range(prop_list.n_values):
+                info["formats"].append(prop_list.get_nth(i))
+    if info["formats"] == 1:
         return 1
-    prop_list = caps.get_structure(0).get_list("format").array
-    for i in range(prop_list.n_values):
-        data.append(prop_list.get_nth(i))
-    return data
+    return list(info["formats"])
 
 
 def get_num_pads(element_name, pad_name):
@@ -284,14 +1289,14 @@ def get_num_pads(element_name, pad_name):
         element_name: factory name of gst element
         pad_name: GstPad
     """
-    elem = Gst.ElementFactory.make(element_name)
-    num_pad = None
-    if pad_name == "src":
-        num_pad = elem.numsrcpads
-    elif pad_name == "sink":
-        num_pad = elem.numsinkpads
-    del elem
-    return num_pad
+    info = get_factory_info(Gst.ElementFactory.find(element_name))
+    if pad_name not in info["num_pads"]:
+        # Always pads are known only after instantiating the element
+        elem = Gst.ElementFactory.make(element_name)
+        info["num_pads"]["src"] = elem.numsrcpads
+        info["num_pads"]["sink"] = elem.numsinkpads
+        del elem
+    return info["num_pads"].get(pad_name)
 
 
 def get_format_string(element, pad_name):
@@ -393,6 +1398,123 @@ def get_format(pipeline, input_elements):
     return format
 
 
+def get_source_stat(source, index=0):
+    """
+    Returns a string of the modification time and size of a file source,
+    None if the source is not a file. For image sequences with % in the
+    path, every file read by multifilesrc from index on is covered, so
+    that replacing or adding any frame of the sequence changes it
+    Args:
+        source: path of the file or image sequence
+        index: index of first file of image sequence
+    """
+    if "%" in source:
+        files = []
+        while os.path.isfile(source % (index + len(files))):
+            files.append(source % (index + len(files)))
+    elif os.path.isfile(source):
+        files = [source]
+    else:
+        return None
+    if len(files) == 0:
+        return None
+    desc = ["%d" % len(files)]
+    for path in files:
+        stat = os.stat(path)
+        desc.append("%d %d" % (stat.st_mtime, stat.st_size))
+    return hashlib.sha1("\n".join(desc).encode()).hexdigest()
+
+
+def get_input_key(input, input_elements):
+    """
+    Returns the key identifying an input in format cache. It covers the
+    source, the elements with their caps, the gst plugin map in use and
+    the modification time and size of file sources
+    Args:
+        input: Input object
+        input_elements: List of input gst elements
+    """
+    desc = [str(input.source), yaml.safe_dump(gst_element_map)]
+    for elem in input_elements:
+        desc.append(elem.get_factory().get_name())
+        if elem.get_factory().get_name() == "capsfilter":
+            caps = elem.get_property("caps")
+            if caps:
+                desc.append(caps.to_string())
+    if str(input.source).startswith("/dev/"):
+        # Different sensor may be attached to same node after reboot
+        desc += [str(input.sen_id), str(input.subdev_id), str(input.format)]
+    else:
+        # File replaced at same path may be encoded differently
+        stat = get_source_stat(str(input.source), input.index)
+        if stat != None:
+            desc.append(stat)
+    return hashlib.sha1("\n".join(desc).encode()).hexdigest()
+
+
+def load_format_cache():
+    """
+    Returns the format cache stored on disk, empty if not present
+    """
+    try:
+        with open(FORMAT_CACHE_PATH, "r") as f:
+            cache = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError):
+        return {}
+    if type(cache) != dict:
+        return {}
+    return cache
+
+
+def save_format_cache(cache):
+    """
+    Store the format cache on disk
+    Args:
+        cache: Dictionary of input key to format
+    """
+    try:
+        os.makedirs(os.path.dirname(FORMAT_CACHE_PATH), exist_ok=True)
+        with open(FORMAT_CACHE_PATH, "w") as f:
+            yaml.safe_dump(cache, f)
+    except OSError:
+        print("[WARNING] Could not write format cache %s" % FORMAT_CACHE_PATH)
+
+
+def get_cached_format(pipeline, input):
+    """
+    Returns the format of input pipeline. The format is looked up in the
+    format cache and the pipeline is probed only when it is not known or
+    --reprobe is given.
+    Args:
+        pipeline: Gst Pipeline of the input
+        input: Input object
+    """
+    key = get_input_key(input, input.gst_inp_elements)
+    cache = load_format_cache()
+    if not utils.args.reprobe and key in cache:
+        return cache[key]
+
+    format = get_format(pipeline, input.gst_inp_elements)
+    if format:
+        cache[key] = format
+        save_format_cache(cache)
+    return format
+
+
+def get_element_name(factory_name):
+    """
+    Returns a unique name for an element to be made, None if gst should
+    name it
+    Args:
+        factory_name: factory name of the element
+    """
+    global element_name_count
+    if element_name_prefix == None:
+        return None
+    element_name_count += 1
+    return "%s%s%d" % (element_name_prefix, factory_name, element_name_count)
+
+
 def make_element(config, property=None, caps=None):
     """
     Make a GST Element and set property and caps
@@ -402,12 +1524,14 @@ def make_element(config, property=None, caps=None):
         caps: capsfilter if any
     """
     if type(config) is str:
-        element = Gst.ElementFactory.make(config)
+        element = Gst.ElementFactory.make(config, get_element_name(config))
     else:
         if not config or "element" not in config or config["element"] == None:
             print("[ERROR] Element cannot be NULL. Please check plugins_map file.")
             sys.exit()
-        element = Gst.ElementFactory.make(config["element"])
+        element = Gst.ElementFactory.make(
+            config["element"], get_element_name(config["element"])
+        )
 
     if not element:
         if type(config) is str:
@@ -423,7 +1547,9 @@ def make_element(config, property=None, caps=None):
 
     if caps != None:
         caps = Gst.caps_from_string(caps)
-        caps_filter = Gst.ElementFactory.make("capsfilter")
+        caps_filter = Gst.ElementFactory.make(
+            "capsfilter", get_element_name("capsfilter")
+        )
         caps_filter.set_property("caps", caps)
         return [element, caps_filter]
 
@@ -498,10 +1624,108 @@ def add_and_link(elements_list, player=None):
             elements_list[i].connect(
                 "pad-added", on_new_src_pad_added, elements_list[i + 1]
             )
+            dynamic_links.append(
+                (elements_list[i].get_name(), elements_list[i + 1].get_name())
+            )
 
     return player
 
 
+def decode_clip(input, clip):
+    """
+    Decode a clip once to a file of raw NV12 frames of input resolution.
+    Returns path of the raw file, decoding is skipped if the clip was
+    already decoded.
+    Args:
+        input: input configuration
+        clip: path of the video file or image sequence
+    """
+    stat = get_source_stat(clip, input.index)
+    if stat == None:
+        print("[ERROR] Clip %s does not exist" % clip)
+        sys.exit(1)
+    cache_dir = input.cache_dir
+    desc = "%s %d %s %d %d" % (
+        os.path.abspath(clip),
+        input.index,
+        stat,
+        input.width,
+        input.height,
+    )
+    raw_file = os.path.join(
+        cache_dir, hashlib.sha1(desc.encode()).hexdigest() + ".nv12"
+    )
+    if os.path.isfile(raw_file):
+        # Mark as recently used for eviction
+        os.utime(raw_file)
+        return raw_file
+
+    os.makedirs(cache_dir, exist_ok=True)
+    if "%" in clip:
+        src = 'multifilesrc location="%s" index=%d' % (clip, input.index)
+    else:
+        src = 'filesrc location="%s"' % clip
+    temp_file = raw_file + ".part"
+    pipeline = Gst.parse_launch(
+        src
+        + " ! decodebin ! videoconvert ! videoscale"
+        + " ! video/x-raw, format=NV12, width=%d, height=%d"
+        % (input.width, input.height)
+        + ' ! filesink location="%s"' % temp_file
+    )
+    print("[INFO] Decoding %s to %s" % (clip, raw_file))
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS
+    )
+    pipeline.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        err, debug_info = msg.parse_error()
+        print("[ERROR]", err.message)
+        sys.exit(1)
+    os.rename(temp_file, raw_file)
+    evict_clips(cache_dir, input.cache_size_mb * 1024 * 1024, raw_file)
+    return raw_file
+
+
+def evict_clips(cache_dir, limit, keep):
+    """
+    Remove least recently used decoded clips until the cache fits the limit.
+    Args:
+        cache_dir: directory of the decoded clips
+        limit: max total size of the decoded clips in bytes
+        keep: path of the clip about to be replayed, never removed
+    """
+    clips = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".nv12"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        clips.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    for _, size, path in sorted(clips):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        print("[INFO] Evicted decoded clip %s" % path)
+        total -= size
+    if total > limit:
+        print(
+            "[WARNING] Decoded clip %s is larger than cache-size-mb, kept "
+            "while in use" % keep
+        )
+
+
 def get_input_elements(input):
     """
     Construct the list of gst input elements
@@ -568,6 +1792,15 @@ def get_input_elements(input):
         source = "http"
     elif input.source.startswith("rtsp"):
         source = "rtsp"
+    elif input.source.startswith("cache:"):
+        clip = input.source[len("cache:"):]
+        if "%" in clip:
+            exists = os.path.exists(clip % input.index)
+        else:
+            exists = os.path.isfile(clip)
+        if not exists:
+            status = "no file"
+        source = "cached"
     elif os.path.isfile(input.source):
         if (source_ext == ".h264" or source_ext == ".h265"):
             source = 'raw_video'
@@ -717,6 +1950,24 @@ def get_input_elements(input):
             element = make_element(i[0], property=i[1], caps=i[2])
             input_element_list += element
 
+    elif source == "cached":
+        # Replay frames decoded once, so that decoding is not measured
+        raw_file = decode_clip(input, clip)
+        property = {"location": raw_file, "name": source_name}
+        element = make_element("filesrc", property=property)
+        input_element_list += element
+
+        caps = "video/x-raw, format=NV12, width=%d, height=%d" % (
+            input.width,
+            input.height,
+        )
+        element = make_element("rawvideoparse", caps=caps)
+        Gst.util_set_object_arg(element[0], "format", "nv12")
+        Gst.util_set_object_arg(element[0], "width", str(input.width))
+        Gst.util_set_object_arg(element[0], "height", str(input.height))
+        Gst.util_set_object_arg(element[0], "framerate", str(input.fps))
+        input_element_list += element
+
     elif source == "image":
         property = {
             "location": input.source,
@@ -805,6 +2056,8 @@ def get_scaler_elements(flow, is_multi_src):
     If multisrc -> [[Multiscaler],[queue,capsfilter],[queue,capsfilter,...]]
     If not ->      [[queue,videoscale,capsfilter],[queue,videoscale,capsfilter]]
 
+    Sensor path list is empty if the flow has no sensor path.
+
     Args:
         input: input configuration
         is_multi_src: Does the scaler element used supports multiple src pads
@@ -816,8 +2069,11 @@ def get_scaler_elements(flow, is_multi_src):
         flow.sensor_height,
     )
     if is_multi_src == False:
-        sensor_list += make_element("queue")  # Sensor_Path
-        sensor_list += make_element(gst_element_map["scaler"], caps=sensor_scaler_caps)
+        if not flow.headless:
+            sensor_list += make_element("queue")  # Sensor_Path
+            sensor_list += make_element(
+                gst_element_map["scaler"], caps=sensor_scaler_caps
+            )
         dl_list += make_element("queue")  # DL_PATH
         dl_list += get_dl_scaler_elements(flow, is_multi_src=False)
 
@@ -827,7 +2083,8 @@ def get_scaler_elements(flow, is_multi_src):
             property={"name": flow.gst_scaler_name},
         )
         pipe += element
-        sensor_list += make_element("queue", caps=sensor_scaler_caps)
+        if not flow.headless:
+            sensor_list += make_element("queue", caps=sensor_scaler_caps)
         dl_list = get_dl_scaler_elements(flow, is_multi_src)
 
     pipe.append(sensor_list)
@@ -1154,9 +2411,8 @@ def get_post_proc_elements(flow):
     post_proc_elements = []
     property = {
         "format": 3,
-        #    "is-live": True,
+        "is-live": True,
         "block": True,
-        "do-timestamp": True,
         "name": flow.gst_post_sink_name,
     }
     element = make_element("appsrc", property=property)
@@ -1177,14 +2433,35 @@ def get_post_proc_elements(flow):
     return post_proc_elements
 
 
-def get_color_convert_config(input_format, output_format):
+# Bytes per pixel of formats, used to weigh the bandwidth of a conversion
+FORMAT_BYTES_PER_PIXEL = {
+    "GRAY8": 1,
+    "NV12": 1.5,
+    "NV21": 1.5,
+    "I420": 1.5,
+    "UYVY": 2,
+    "YUY2": 2,
+    "RGB": 3,
+    "BGR": 3,
+    "RGBx": 4,
+    "BGRx": 4,
+}
+
+# Formats without chroma. Converting to them is cheap by bandwidth but
+# lossy, so they are only planned as the output when nothing else is
+# acceptable, and never as an intermediate hop
+NON_COLOR_FORMATS = {"GRAY8", "GRAY16_LE", "GRAY16_BE"}
+
+# Relative cost of a converter per byte moved. Conversions on hardware
+# accelerators are much cheaper than on the arm cores
+HW_CONVERTER_COST = 1
+CPU_CONVERTER_COST = 8
+
+
+def get_color_converters():
     """
-    Helper function to give appropriate colorconvert element
-    based on plugins available and inputs and outputs can
-    be supported
-    Args:
-        input_format: Input format
-        output_format: Output format
+    Returns the available colorconvert elements as a list of
+    (config, cost, supported (input, output) format pairs)
     """
     tiovxdlcc_combimations = {
         "RGB": ["NV12"],
@@ -1193,46 +2470,135 @@ def get_color_convert_config(input_format, output_format):
         "NV21": ["RGB", "I420"],
     }
 
-    dl_color_convert_element_factory = Gst.ElementFactory.find(
-        gst_element_map["dlcolorconvert"]["element"]
-    )
-    color_convert_element_factory = Gst.ElementFactory.find(
-        gst_element_map["colorconvert"]["element"]
-    )
-    video_convert_element_factory = Gst.ElementFactory.find("videoconvert")
-
-    dlcc_sink_list = get_pad_format(dl_color_convert_element_factory, "sink")
-    cc_sink_list = get_pad_format(color_convert_element_factory, "sink")
-    vc_sink_list = get_pad_format(video_convert_element_factory, "sink")
-
-    dlcc_src_list = get_pad_format(dl_color_convert_element_factory, "src")
-    cc_src_list = get_pad_format(color_convert_element_factory, "src")
-    vc_src_list = get_pad_format(video_convert_element_factory, "src")
-
-    if input_format in dlcc_sink_list and output_format in dlcc_src_list:
-        if dl_color_convert_element_factory.get_name() == "tiovxdlcolorconvert":
-            # Check combination
-            if output_format.upper() in tiovxdlcc_combimations[input_format.upper()]:
-                return gst_element_map["dlcolorconvert"]
+    converters = []
+    configs = [
+        gst_element_map["dlcolorconvert"],
+        gst_element_map["colorconvert"],
+        {"element": "videoconvert"},
+    ]
+    for config in configs:
+        factory = Gst.ElementFactory.find(config["element"])
+        if not factory:
+            continue
+        sink_list = get_pad_format(factory, "sink")
+        src_list = get_pad_format(factory, "src")
+        if sink_list == 1 or src_list == 1:
+            continue
+        if factory.get_name() == "tiovxdlcolorconvert":
+            # Only few combinations are supported by tiovxdlcolorconvert
+            pairs = set(
+                (i, o)
+                for i in sink_list
+                for o in src_list
+                if o.upper() in tiovxdlcc_combimations.get(i.upper(), [])
+            )
+        else:
+            pairs = set((i, o) for i in sink_list for o in src_list if i != o)
+        if factory.get_name().startswith("tiovx"):
+            cost = HW_CONVERTER_COST
         else:
-            return gst_element_map["dlcolorconvert"]
+            cost = CPU_CONVERTER_COST
+        converters.append((config, cost, pairs))
+    return converters
 
-    if input_format in cc_sink_list and output_format in cc_src_list:
-        return gst_element_map["colorconvert"]
 
-    if input_format == 1 or (
-        input_format in vc_sink_list and output_format in vc_src_list
-    ):
-        return {"element": "videoconvert"}
+def get_color_convert_plan(input_format, output_formats):
+    """
+    Returns the cheapest chain of colorconvert elements converting
+    input_format to any of output_formats as list of (config, format).
+    Formats are nodes of a graph and the available colorconvert elements
+    are edges weighed by their cost and the bandwidth they need.
+    Args:
+        input_format: Input format
+        output_formats: List of acceptable output formats
+    """
+    if input_format in output_formats:
+        return []
+
+    # Keep the chroma of colour inputs if any colour output is acceptable
+    color_formats = [f for f in output_formats if f not in NON_COLOR_FORMATS]
+    if input_format not in NON_COLOR_FORMATS and color_formats:
+        output_formats = color_formats
+
+    if input_format == 1:
+        # Unknown input format can only be handled by videoconvert
+        if "NV12" in output_formats:
+            return [({"element": "videoconvert"}, "NV12")]
+        output_format = min(
+            output_formats, key=lambda f: FORMAT_BYTES_PER_PIXEL.get(f, 3)
+        )
+        return [({"element": "videoconvert"}, output_format)]
+
+    edges = {}
+    for config, cost, pairs in get_color_converters():
+        for i, o in pairs:
+            if o in NON_COLOR_FORMATS and o not in output_formats:
+                continue
+            weight = cost * (
+                FORMAT_BYTES_PER_PIXEL.get(i, 3) + FORMAT_BYTES_PER_PIXEL.get(o, 3)
+            )
+            edges.setdefault(i, []).append((weight, o, config))
+
+    # Dijkstra's shortest path from input_format
+    visited = set()
+    # (distance, tie breaker, format, plan)
+    heap = [(0, 0, input_format, [])]
+    counter = 1
+    while heap:
+        distance, _, format, plan = heapq.heappop(heap)
+        if format in visited:
+            continue
+        if format in output_formats:
+            return plan
+        visited.add(format)
+        for weight, next_format, config in edges.get(format, []):
+            if next_format not in visited:
+                heapq.heappush(
+                    heap,
+                    (
+                        distance + weight,
+                        counter,
+                        next_format,
+                        plan + [(config, next_format)],
+                    ),
+                )
+                counter += 1
 
     print(
         "[ERROR] %s->%s not supported by available colorconvert elements."
-        % (input_format, output_format)
+        % (input_format, "/".join(output_formats))
     )
     sys.exit(1)
 
 
-def get_gst_pipe(flows, outputs):
+def get_color_convert_elements(
+    input_format, output_formats, pool_size=True, target=False
+):
+    """
+    Returns the gst elements of the cheapest colorconvert chain and the
+    resulting format
+    Args:
+        input_format: Input format
+        output_formats: List of acceptable output formats
+        pool_size: Set out-pool-size given in plugins map
+        target: Set last target given in plugins map
+    """
+    elements = []
+    format = input_format
+    for config, format in get_color_convert_plan(input_format, output_formats):
+        property = {}
+        if "property" in config:
+            prop = config["property"]
+            if target and "target" in prop:
+                property["target"] = prop["target"][-1]
+            if pool_size and "out-pool-size" in prop:
+                property["out-pool-size"] = prop["out-pool-size"]
+        caps = "video/x-raw, format=%s" % format
+        elements += make_element(config, property=property, caps=caps)
+    return elements, format
+
+
+def get_gst_pipe(flows, outputs, sink_player=None):
     """
     Construct the src and sink pipelines.
     This function connects the input,scaler,sensor and dl paths and adds
@@ -1241,6 +2607,7 @@ def get_gst_pipe(flows, outputs):
     Args:
         flows: List of flows
         outputs: List of outputs
+        sink_player: sink pipeline to add to, for flows attached at runtime
     """
 
     scaler_element_factory = Gst.ElementFactory.find(
@@ -1261,7 +2628,6 @@ def get_gst_pipe(flows, outputs):
     color_convert_format_list = get_pad_format(color_convert_element_factory, "sink")
 
     src_players = []
-    sink_player = None
 
     for index, f in enumerate(flows):
         # ====================== SOURCE ===========================
@@ -1280,7 +2646,7 @@ def get_gst_pipe(flows, outputs):
                     Gst.ChildProxy.set_property(elem, "sink_0::device", device)
 
         # Get format of last input element after caps negotiation
-        input_format = get_format(gst_player, f.input.gst_inp_elements)
+        input_format = get_cached_format(gst_player, f.input)
         if not input_format:
             last_element_index = len(f.input.gst_inp_elements) - 1
             while (
@@ -1298,17 +2664,14 @@ def get_gst_pipe(flows, outputs):
                 input_format = input_format[0]
 
         # Add color convert if input format isnt supported by scaler
-        if input_format not in scaler_format_list:
-            # Assuming that colorconvert supports NV12 on srcpad
-            color_convert_element = get_color_convert_config(input_format, "NV12")
-
-            caps = "video/x-raw, format=NV12"
-            element = make_element(color_convert_element, caps=caps)
+        if scaler_format_list != 1 and input_format not in scaler_format_list:
+            element, input_format = get_color_convert_elements(
+                input_format, scaler_format_list, pool_size=False
+            )
             gst_player = add_and_link(element, player=gst_player)
             # Link last element of inp pipe to colorconvert
             link_elements(f.input.gst_inp_elements[-1], element[0])
             f.input.gst_inp_elements += element
-            input_format = "NV12"
 
         last_inp_element = f.input.gst_inp_elements[-1]
         # =========================================================
@@ -1337,62 +2700,14 @@ def get_gst_pipe(flows, outputs):
             subflow_format = input_format
 
             # get_pad_format returns 1 in case if element supports any format (For Example: Appsink)
-            if pre_proc_elem_format == 1 and subflow_format != expected_end_format:
-                # Add colorconvert
-                color_convert_element = get_color_convert_config(
-                    subflow_format, expected_end_format
-                )
-
-                caps = "video/x-raw, format=%s" % expected_end_format
-                property = {}
-                if "property" in color_convert_element:
-                    prop = color_convert_element["property"]
-                    if "out-pool-size" in prop:
-                        property["out-pool-size"] = prop["out-pool-size"]
-
-                dl += make_element(
-                    color_convert_element,
-                    property=property,
-                    caps=caps,
-                )
-                subflow_format = expected_end_format
-
-            # If caps is not any and the input_format is not supported by first element in pre_proc_element_list
-            elif (
-                pre_proc_elem_format != 1 and subflow_format not in pre_proc_elem_format
-            ):
-                common_formats = set(pre_proc_elem_format)
-                # choose best_format and make element
-                best_guess = [expected_end_format, "NV12", "NV21", "I420"]
-                flag_format = None
-                for i in best_guess:
-                    if i in common_formats:
-                        flag_format = i
-                        break
-                if not flag_format:
-                    print(
-                        "[ERROR] %s does not support ['%s' , 'NV12', 'NV21', 'I420']"
-                        % (expected_end_format, pre_proc_elem_factory.get_name())
-                    )
-                    sys.exit(1)
-
-                color_convert_element = get_color_convert_config(
-                    subflow_format, flag_format
-                )
-
-                caps = "video/x-raw, format=%s" % flag_format
-                property = {}
-                if "property" in color_convert_element:
-                    prop = color_convert_element["property"]
-                    if "out-pool-size" in prop:
-                        property["out-pool-size"] = prop["out-pool-size"]
-
-                dl += make_element(
-                    color_convert_element,
-                    property=property,
-                    caps=caps,
-                )
-                subflow_format = flag_format
+            if pre_proc_elem_format == 1:
+                target_formats = [expected_end_format]
+            else:
+                target_formats = pre_proc_elem_format
+            elements, subflow_format = get_color_convert_elements(
+                subflow_format, target_formats
+            )
+            dl += elements
 
             # Put everythin in pre_proc_element list except appsink
             dl += s.gst_pre_proc_elements[:-1]
@@ -1403,24 +2718,11 @@ def get_gst_pipe(flows, outputs):
             if last_dl_element_caps and last_dl_element_caps.get_size() > 0:
                 latest_format = last_dl_element_caps.get_structure(0).get_name()
             if latest_format != "application/x-tensor-tiovx":
-                latest_format = subflow_format  # This isnt tested xD
+                latest_format = subflow_format
                 if latest_format != expected_end_format:
                     # Add colorconvert
-                    color_convert_element = get_color_convert_config(
-                        latest_format, expected_end_format
-                    )
-
-                    caps = "video/x-raw, format=%s" % expected_end_format
-                    property = {}
-                    if "property" in color_convert_element:
-                        prop = color_convert_element["property"]
-                        if "out-pool-size" in prop:
-                            property["out-pool-size"] = prop["out-pool-size"]
-
-                    colorconvert_element = make_element(
-                        color_convert_element,
-                        property=property,
-                        caps=caps,
+                    colorconvert_element, _ = get_color_convert_elements(
+                        latest_format, [expected_end_format]
                     )
                     gst_player = add_and_link(colorconvert_element, player=gst_player)
                     # Link last element in dl path before appsink to colorconvert
@@ -1438,30 +2740,15 @@ def get_gst_pipe(flows, outputs):
             # ====================== SENSOR ===========================
 
             sensor = s.gst_scaler_elements.pop()
-            if input_format != "RGB":
-                # Add colorconvert
-                color_convert_element = get_color_convert_config(input_format, "RGB")
-
-                property = {}
-                if "property" in color_convert_element:
-                    if "target" in color_convert_element["property"]:
-                        property["target"] = color_convert_element["property"][
-                            "target"
-                        ][-1]
-                    if "out-pool-size" in color_convert_element["property"]:
-                        property["out-pool-size"] = color_convert_element["property"][
-                            "out-pool-size"
-                        ]
-                # Assuming that colorconvert supports RGB
-                caps = "video/x-raw,format=RGB"
-                sensor += make_element(
-                    color_convert_element,
-                    property=property,
-                    caps=caps,
+            # Subflow with only metadata outputs has no sensor path
+            if not s.headless:
+                elements, _ = get_color_convert_elements(
+                    input_format, ["RGB"], target=True
                 )
+                sensor += elements
 
-            sensor += s.gst_sensor_elements
-            gst_player = add_and_link(sensor, player=gst_player)
+                sensor += s.gst_sensor_elements
+                gst_player = add_and_link(sensor, player=gst_player)
             # =========================================================
 
             if s.flow.is_multi_scaler == False:
@@ -1471,7 +2758,8 @@ def get_gst_pipe(flows, outputs):
                 to dirst element in sensor and dl path
                 """
 
-                link_elements(last_inp_element, sensor[0])
+                if not s.headless:
+                    link_elements(last_inp_element, sensor[0])
                 link_elements(last_inp_element, dl[0])
             else:
                 if len(f.sub_flows) > 1:
@@ -1489,13 +2777,16 @@ def get_gst_pipe(flows, outputs):
                 gst_player = add_and_link(gst_scaler_elements, player=gst_player)
 
                 link_elements(last_inp_element, gst_scaler_elements[0])
-                link_elements(gst_scaler_elements[-1], sensor[0])
+                if not s.headless:
+                    link_elements(gst_scaler_elements[-1], sensor[0])
                 link_elements(gst_scaler_elements[-1], dl[0])
 
         src_players.append(gst_player)
 
         # ====================== SINK ===========================
         for s_index, s in enumerate(f.sub_flows):
+            if s.headless:
+                continue
             sink_player = add_and_link(s.gst_post_proc_elements, player=sink_player)
             for index, o in enumerate(s.outputs):
                 if o.mosaic:
@@ -1620,3 +2911,325 @@ def get_gst_pipe(flows, outputs):
                     sink_player = add_and_link(o.gst_disp_elements, player=sink_player)
                     link_elements(s.gst_post_proc_elements[-1], o.gst_disp_elements[0])
     return src_players, sink_player
+
+
+def get_plan_key(config):
+    """
+    Returns the key identifying the pipeline plan of a config. It covers
+    the app config, the gst plugin map in use, the param.yaml of every
+    model, whose pre-processing is baked in the plan, and the files of
+    every input, whose probed format is baked in the plan
+    Args:
+        config: Dictionary of params pased from config file
+    """
+    desc = [yaml.safe_dump(config), yaml.safe_dump(gst_element_map)]
+    for name in sorted(config["models"]):
+        model_path = config["models"][name]["model_path"]
+        try:
+            with open(os.path.join(model_path, "param.yaml"), "rb") as f:
+                desc.append(hashlib.sha1(f.read()).hexdigest())
+        except OSError:
+            desc.append("")
+    for name in sorted(config["inputs"]):
+        input_config = config["inputs"][name]
+        index = input_config["index"] if "index" in input_config else 0
+        desc.append(str(get_source_stat(str(input_config["source"]), index)))
+    return hashlib.sha1("\n".join(desc).encode()).hexdigest()
+
+
+def load_plan(key):
+    """
+    Returns the pipeline plan stored on disk, None if not present
+    Args:
+        key: key returned by get_plan_key
+    """
+    try:
+        with open(os.path.join(PLAN_CACHE_DIR, key + ".yaml"), "r") as f:
+            plan = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError):
+        return None
+    if type(plan) != dict or plan.get("version") != PLAN_VERSION:
+        return None
+    return plan
+
+
+def save_plan(key, plan):
+    """
+    Store the pipeline plan on disk. Plans which do not survive a round
+    trip through parse_launch are not stored
+    Args:
+        key: key returned by get_plan_key
+        plan: plan returned by make_plan
+    """
+    if not check_plan(plan):
+        print("[WARNING] Pipeline plan does not parse back, not storing it")
+        return
+    try:
+        os.makedirs(PLAN_CACHE_DIR, exist_ok=True)
+        with open(os.path.join(PLAN_CACHE_DIR, key + ".yaml"), "w") as f:
+            yaml.safe_dump(plan, f)
+    except OSError:
+        print("[WARNING] Could not write pipeline plan to %s" % PLAN_CACHE_DIR)
+
+
+def check_plan(plan):
+    """
+    Returns True if the pipelines parsed from the plan describe back to
+    the plan, i.e. every property, including pad properties of mosaic,
+    is serialized in a form parse_launch reads
+    Args:
+        plan: plan returned by make_plan
+    """
+    descs = plan["src"] + ([plan["sink"]] if plan["sink"] else [])
+    for desc in descs:
+        try:
+            pipeline = Gst.parse_launch(desc)
+        except GLib.Error:
+            return False
+        if get_pipeline_description(pipeline) != desc:
+            return False
+    return True
+
+
+def serialize_value(value, value_type=None):
+    """
+    Returns value of a property in gst-launch syntax, None if the type
+    of value is not supported
+    Args:
+        value: value of the property
+        value_type: GType of the property, used to serialize arrays
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, GObject.GEnum):
+        return value.value_nick
+    if isinstance(value, GObject.GFlags):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, str):
+        return '"%s"' % value.replace("\\", "\\\\").replace('"', '\\"')
+    if isinstance(value, Gst.Caps):
+        return '"%s"' % value.to_string().replace('"', '\\"')
+    if value_type != None and isinstance(value, (GObject.ValueArray, list, tuple)):
+        # Arrays like the pad properties of mosaic are serialized by gst
+        # itself, so that parse_launch reads them back
+        try:
+            string = Gst.value_serialize(GObject.Value(value_type, value))
+        except (TypeError, ValueError):
+            return None
+        if string == None:
+            return None
+        return '"%s"' % string.replace("\\", "\\\\").replace('"', '\\"')
+    return None
+
+
+def get_property_string(obj, prefix=""):
+    """
+    Returns the non default properties of an element or a pad in
+    gst-launch syntax
+    Args:
+        obj: GstElement or GstPad
+        prefix: prefix of property names, child name for pad properties
+    """
+    string = ""
+    for prop in obj.list_properties():
+        if prop.name in ("name", "parent"):
+            continue
+        if not (
+            prop.flags & GObject.ParamFlags.READABLE
+            and prop.flags & GObject.ParamFlags.WRITABLE
+        ):
+            continue
+        try:
+            value = obj.get_property(prop.name)
+            if value == None or value == prop.default_value:
+                continue
+        except:
+            continue
+        value = serialize_value(value, prop.value_type)
+        if value != None:
+            string += " %s%s=%s" % (prefix, prop.name, value)
+    return string
+
+
+def get_pipeline_description(pipeline):
+    """
+    Returns gst-launch description of a pipeline holding its elements,
+    non default properties, pad properties and links. Links through
+    sometimes pads are left out, they are kept in dynamic_links of the plan
+    Args:
+        pipeline: Gst Pipeline
+    """
+    elements = []
+    links = []
+    skipped = set(dynamic_links)
+    for elem in pipeline.iterate_elements():
+        desc = elem.get_factory().get_name() + " name=" + elem.get_name()
+        desc += get_property_string(elem)
+        # Pad properties of mosaic, isp etc are exposed through ChildProxy
+        if isinstance(elem, Gst.ChildProxy):
+            for pad in elem.pads:
+                desc += get_property_string(pad, pad.get_name() + "::")
+        elements.append(desc)
+        for pad in elem.srcpads:
+            peer = pad.get_peer()
+            if peer and (elem.get_name(), peer.get_parent().get_name()) not in skipped:
+                links.append(
+                    "%s.%s ! %s.%s"
+                    % (
+                        elem.get_name(),
+                        pad.get_name(),
+                        peer.get_parent().get_name(),
+                        peer.get_name(),
+                    )
+                )
+
+    # iterate_elements walks the bin in reverse order of addition
+    elements.reverse()
+    return " ".join(elements + links)
+
+
+def make_plan(src_pipes, sink_pipe, outputs):
+    """
+    Returns the resolved topology of constructed pipelines as a plan
+    which can be stored and instantiated with get_gst_pipe_from_plan
+    Args:
+        src_pipes: List of gst pipeline for src (input)
+        sink_pipe: gst pipeline for sink (output)
+        outputs: List of outputs
+    """
+    mosaic_prop = {}
+    for o in outputs.values():
+        if o.mosaic:
+            mosaic_prop[o.id] = {
+                k: [list(i) for i in v] for k, v in o.mosaic_prop.items()
+            }
+    return {
+        "src": [get_pipeline_description(pipe) for pipe in src_pipes],
+        "sink": get_pipeline_description(sink_pipe) if sink_pipe else None,
+        "dynamic_links": [list(link) for link in dynamic_links],
+        "mosaic_prop": mosaic_prop,
+        "version": PLAN_VERSION,
+    }
+
+
+def connect_dynamic_links(pipeline, links):
+    """
+    Link elements with sometimes pads of a parsed pipeline every time
+    the pad is added, like add_and_link does. Delayed links of
+    parse_launch are made only once, so pads added when a source is
+    restarted would stay unlinked.
+    Args:
+        pipeline: Gst Pipeline
+        links: list of [src element name, sink element name]
+    """
+    for src_name, sink_name in links:
+        src = pipeline.get_by_name(src_name)
+        sink = pipeline.get_by_name(sink_name)
+        if src and sink:
+            src.connect("pad-added", on_new_src_pad_added, sink)
+
+
+def get_gst_pipe_from_plan(plan, outputs):
+    """
+    Construct the src and sink pipelines from a plan. Returns None, None
+    if the plan could not be instantiated
+    Args:
+        plan: plan returned by make_plan
+        outputs: List of outputs
+    """
+    try:
+        src_players = [Gst.parse_launch(desc) for desc in plan["src"]]
+        sink_player = None
+        if plan["sink"]:
+            sink_player = Gst.parse_launch(plan["sink"])
+    except GLib.Error as err:
+        print("[WARNING] Could not use pipeline plan, %s" % err.message)
+        return None, None
+    for player in src_players + [sink_player]:
+        if player:
+            connect_dynamic_links(player, plan["dynamic_links"])
+
+    for o in outputs.values():
+        if o.mosaic and o.id in plan["mosaic_prop"]:
+            o.mosaic_prop = plan["mosaic_prop"][o.id]
+            # Refer the mosaic of parsed pipeline so that flows can be
+            # attached to it at runtime
+            mosaic_name = o.gst_mosaic_elements[0].get_name()
+            o.gst_mosaic_elements = [sink_player.get_by_name(mosaic_name)]
+            o.mosaic_added_to_bin = True
+            o.disp_elements_added_to_bin = True
+            o.num_mosaic_sink = len(o.mosaic_prop.get(mosaic_name, []))
+    return src_players, sink_player
+
+
+def remove_sink_branch(pipeline, appsrc, mosaic):
+    """
+    Remove the elements from appsrc of a subflow till the mosaic it is
+    linked to, and release the sink pad of mosaic
+    Args:
+        pipeline: sink gst pipeline
+        appsrc: appsrc element of the subflow
+        mosaic: mosaic element the subflow is linked to
+    """
+    elements = []
+    mosaic_pad = None
+    element = appsrc
+    while element != None:
+        elements.append(element)
+        if len(element.srcpads) == 0:
+            break
+        peer = element.srcpads[0].get_peer()
+        if peer == None:
+            break
+        if peer.get_parent() == mosaic:
+            mosaic_pad = peer
+            break
+        element = peer.get_parent()
+
+    for element in elements:
+        element.set_state(Gst.State.NULL)
+    if mosaic_pad:
+        mosaic_pad.get_peer().unlink(mosaic_pad)
+        mosaic.release_request_pad(mosaic_pad)
+    for element in elements:
+        pipeline.remove(element)
+
+
+def remove_elements(pipeline, names):
+    """
+    Remove elements from a pipeline, unlinking them from the elements
+    which stay and releasing the request pads they were linked to
+    Args:
+        pipeline: gst pipeline
+        names: names of the elements to be removed
+    """
+    elements = [pipeline.get_by_name(name) for name in names]
+    elements = [e for e in elements if e != None]
+    for element in elements:
+        element.set_state(Gst.State.NULL)
+        for pad in element.srcpads:
+            peer = pad.get_peer()
+            if peer == None or peer.get_parent().get_name() in names:
+                continue
+            pad.unlink(peer)
+            template = peer.get_pad_template()
+            if template and template.presence == Gst.PadPresence.REQUEST:
+                peer.get_parent().release_request_pad(peer)
+    for element in elements:
+        pipeline.remove(element)
+
+
+def print_plan(plan):
+    """
+    Print the pipeline plan
+    Args:
+        plan: plan returned by make_plan
+    """
+    for index, desc in enumerate(plan["src"]):
+        print("[SRC-PIPE-%d]\n%s\n" % (index, desc.replace(" ! ", " !\n    ")))
+    for src_name, sink_name in plan["dynamic_links"]:
+        print("[DYNAMIC-LINK] %s ! %s" % (src_name, sink_name))
+    if plan["sink"]:
+        print("[SINK-PIPE]\n%s\n" % plan["sink"].replace(" ! ", " !\n    "))
@@ -0,0 +1,158 @@
+#  Copyright (C) 2021 Texas Instruments Incorporated - http://www.ti.com/
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+from time import time
+import threading
+from queue import Queue, Empty
+
+
+class InferRequest:
+    """
+    Class to hold a tensor submitted to the broker and its result
+    """
+
+    def __init__(self, input_img):
+        """
+        Constructor of InferRequest class
+        Args:
+            input_img: pre-processed input tensor
+        """
+        self.input_img = input_img
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferBroker:
+    """
+    Class to share one model instance between multiple subflows.
+    Tensors submitted by all the subflows using the model are collected
+    with in a deadline and run as a single batch or back to back from
+    one thread, so that the runtime object is never called concurrently.
+    """
+
+    def __init__(self, model, num_clients):
+        """
+        Constructor of InferBroker class
+        Args:
+            model: ModelConfig object shared by the subflows
+            num_clients: Number of subflows using the model
+        """
+        self.model = model
+        self.num_clients = num_clients
+        self.batch_timeout = model.batch_timeout / 1000
+        self.batch = model.batch
+        self.requests = Queue()
+        self.stop_thread = False
+        self.broker_thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """
+        Start the broker
+        """
+        self.broker_thread.start()
+
+    def stop(self):
+        """
+        Stop the broker and wait for it to exit
+        """
+        self.stop_thread = True
+        if self.broker_thread.is_alive():
+            self.broker_thread.join()
+
+    def infer(self, input_img):
+        """
+        Submit a tensor and wait for its result
+        Args:
+            input_img: pre-processed input tensor
+        """
+        request = InferRequest(input_img)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error:
+            raise request.error
+        return request.result
+
+    def collect(self):
+        """
+        Collect requests till every client has submitted one or the
+        deadline from the first request expires
+        """
+        try:
+            requests = [self.requests.get(timeout=0.5)]
+        except Empty:
+            return []
+
+        deadline = time() + self.batch_timeout
+        while len(requests) < self.num_clients:
+            try:
+                remaining = deadline - time()
+                if remaining > 0:
+                    requests.append(self.requests.get(timeout=remaining))
+                else:
+                    requests.append(self.requests.get_nowait())
+            except Empty:
+                break
+        return requests
+
+    def run_batch(self, requests):
+        """
+        Run the collected requests and set their results
+        Args:
+            requests: List of InferRequest
+        """
+        if self.batch and len(requests) > 1:
+            try:
+                batch = np.concatenate([r.input_img for r in requests])
+                results = self.model.run_time(batch)
+                for i, r in enumerate(requests):
+                    r.result = [out[i : i + 1] for out in results]
+            except Exception as e:
+                for r in requests:
+                    r.error = e
+        else:
+            for r in requests:
+                try:
+                    r.result = self.model.run_time(r.input_img)
+                except Exception as e:
+                    r.error = e
+
+        for r in requests:
+            r.done.set()
+
+    def run(self):
+        """
+        Callback function for broker thread
+        """
+        while self.stop_thread == False:
+            requests = self.collect()
+            if len(requests) > 0:
+                self.run_batch(requests)
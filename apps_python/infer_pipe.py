@@ -31,35 +31,116 @@
 import numpy as np
 from time import time
 import threading
+from queue import Queue
 import utils
 import debug
-from post_process import PostProcess
+from gst_wrapper import SamplePairer, release_array
+from post_process import PostProcess, get_draw_context
+from post_process_pool import PostProcessPool
+
+class MotionGate:
+    """
+    Class to detect if the scene changed since the last inferred frame
+    using a cheap downsampled luma signature of the input tensor
+    """
+
+    GRID_SIZE = 32
+    # Range assumed for float tensors, which are mean/scale normalized
+    FLOAT_RANGE = 1.0
+
+    def __init__(self, threshold, layout, data_type):
+        """
+        Constructor of MotionGate class
+        Args:
+            threshold: Min change, as fraction of the data type range, to infer
+            layout: data layout of the tensor (NHWC or NCHW)
+            data_type: numpy data type of the tensor
+        """
+        self.threshold = threshold
+        self.layout = layout
+        if np.issubdtype(data_type, np.integer):
+            info = np.iinfo(data_type)
+            self.value_range = float(info.max) - float(info.min)
+        else:
+            self.value_range = MotionGate.FLOAT_RANGE
+        self.last_signature = None
+
+    def get_signature(self, input_img):
+        """
+        Returns the downsampled luma signature of the tensor
+        Args:
+            input_img: pre-processed input tensor
+        """
+        if self.layout == "NCHW":
+            step = max(1, input_img.shape[2] // MotionGate.GRID_SIZE)
+            return input_img[0, :, ::step, ::step].mean(axis=0, dtype=np.float32)
+        step = max(1, input_img.shape[1] // MotionGate.GRID_SIZE)
+        return input_img[0, ::step, ::step, :].mean(axis=-1, dtype=np.float32)
+
+    def is_changed(self, input_img):
+        """
+        Check if the tensor changed enough from the last inferred tensor.
+        The signature is remembered only if change is detected.
+        Args:
+            input_img: pre-processed input tensor
+        """
+        signature = self.get_signature(input_img)
+        if self.last_signature is not None:
+            change = np.mean(np.abs(signature - self.last_signature))
+            change /= self.value_range
+            if change < self.threshold:
+                return False
+        self.last_signature = signature
+        return True
+
 
 class InferPipe:
     """
     Class to abstract the threading of multiple inference pipelines
     """
 
-    def __init__(self, sub_flow, gst_pipe):
+    def __init__(self, sub_flow, gst_pipe, broker=None):
         """
         Constructor to create an InferPipe object.
         Args:
             sub_flow: sub_flow configuration
             gst_pipe: gstreamer pipe object
+            broker: InferBroker of the model if it is shared across subflows
         """
         self.sub_flow = sub_flow
         self.gst_pipe = gst_pipe
         self.gst_pre_inp = gst_pipe.get_src(sub_flow.gst_pre_src_name, sub_flow.flow.id)
-        self.gst_sen_inp = gst_pipe.get_src(sub_flow.gst_sen_src_name, sub_flow.flow.id)
+        # Subflow with only metadata outputs has no sensor and sink path
+        self.headless = sub_flow.headless
+        self.metadata_writers = [o.metadata_writer for o in sub_flow.metadata_outputs]
+        self.gst_sen_inp = None
+        if not self.headless:
+            self.gst_sen_inp = gst_pipe.get_src(
+                sub_flow.gst_sen_src_name, sub_flow.flow.id
+            )
         self.run_time = sub_flow.model.run_time
+        self.broker = broker
+        self.max_latency = sub_flow.input.max_latency_ms * 1000000
+        self.last_result = None
+        self.infer_interval = sub_flow.model.infer_interval
+        self.frame_index = 0
+        self.motion_gate = None
+        if sub_flow.input.motion_threshold > 0:
+            self.motion_gate = MotionGate(
+                sub_flow.input.motion_threshold,
+                sub_flow.model.data_layout,
+                sub_flow.model.data_type,
+            )
         self.post_proc = PostProcess.get(sub_flow)
 
-        self.gst_post_out = gst_pipe.get_sink(
-            sub_flow.gst_post_sink_name,
-            sub_flow.sensor_width,
-            sub_flow.sensor_height,
-            sub_flow.input.fps,
-        )
+        self.gst_post_out = None
+        if not self.headless:
+            self.gst_post_out = gst_pipe.get_sink(
+                sub_flow.gst_post_sink_name,
+                sub_flow.sensor_width,
+                sub_flow.sensor_height,
+                sub_flow.input.fps,
+            )
         self.param = sub_flow.model
         self.pre_proc_debug = None
         self.infer_debug = None
@@ -70,14 +151,56 @@ class InferPipe:
             if sub_flow.debug_config.inference:
                 self.infer_debug = debug.Debug(sub_flow.debug_config, "infer")
 
-        self.pipeline_thread = threading.Thread(target=self.pipeline)
+        # Draw in worker processes if post-proc-workers is given
+        self.post_proc_pool = None
+        if sub_flow.input.post_proc_workers > 0 and not self.headless:
+            if self.post_proc.debug:
+                print(
+                    "[WARNING] post-proc-workers is ignored since "
+                    + "post-processing debug is enabled."
+                )
+            else:
+                self.post_proc_pool = PostProcessPool(
+                    get_draw_context(sub_flow),
+                    sub_flow.input.post_proc_workers,
+                    sub_flow.sensor_width,
+                    sub_flow.sensor_height,
+                    self.push_frame,
+                )
+
+        # Pair tensor and frame by PTS if reorder window is given
+        self.pairer = None
+        if sub_flow.input.pair_window > 0 and not self.headless:
+            self.pairer = SamplePairer(
+                gst_pipe,
+                self.gst_pre_inp,
+                self.gst_sen_inp,
+                sub_flow.input.loop,
+                sub_flow.input.pair_window,
+                sub_flow.report,
+            )
+
+        # pipeline-depth > 0 splits the pipe into capture, inference and
+        # post-process stages connected with bounded queues
+        self.pipeline_depth = sub_flow.input.pipeline_depth
+        if self.pipeline_depth > 0:
+            self.infer_queue = Queue(maxsize=self.pipeline_depth)
+            self.post_queue = Queue(maxsize=self.pipeline_depth)
+            self.pipeline_threads = [
+                threading.Thread(target=self.capture_stage),
+                threading.Thread(target=self.inference_stage),
+                threading.Thread(target=self.post_process_stage),
+            ]
+        else:
+            self.pipeline_threads = [threading.Thread(target=self.pipeline)]
         self.stop_thread = False
 
     def start(self):
         """
         Start the pipeline
         """
-        self.pipeline_thread.start()
+        for t in self.pipeline_threads:
+            t.start()
 
     def stop(self):
         """
@@ -89,7 +212,193 @@ class InferPipe:
         """
         Waiting for exit, to be called by parent thread
         """
-        self.pipeline_thread.join()
+        for t in self.pipeline_threads:
+            t.join()
+        if self.post_proc_pool:
+            self.post_proc_pool.close()
+
+    def get_tensor(self, sample):
+        """
+        Convert the sample pulled from dl path to input tensor
+        Args:
+            sample: Gst.Sample pulled from dl path
+        """
+        input_img = self.gst_pipe.tensor_from_sample(
+            sample,
+            self.sub_flow.model.crop[0],
+            self.sub_flow.model.crop[1],
+            self.sub_flow.model.data_layout,
+            self.sub_flow.model.data_type,
+        )
+        if self.pre_proc_debug:
+            self.pre_proc_debug.log(str(input_img.flatten()))
+        return input_img
+
+    def is_stale(self, sample):
+        """
+        Check if the sample from dl path already missed the latency deadline
+        Args:
+            sample: Gst.Sample pulled from dl path
+        """
+        if self.max_latency <= 0:
+            return False
+        if self.gst_pipe.get_latency(self.gst_pre_inp, sample) > self.max_latency:
+            self.sub_flow.report.report_count("deadline misses")
+            return True
+        return False
+
+    def capture(self):
+        """
+        Pull the tensor and the corresponding sensor frame. Returns
+        (tensor, frame, pts) where pts is the PTS of the tensor and frame
+        is None if the subflow has no sensor path.
+        Returns None at the end of stream.
+        """
+        if self.pairer:
+            while True:
+                pair = self.pairer.pull()
+                if pair == None:
+                    return None
+                (tensor_sample, _), (frame_sample, descriptor) = pair
+                if not self.is_stale(tensor_sample):
+                    break
+            input_img = self.get_tensor(tensor_sample)
+            frame = self.gst_pipe.frame_from_sample(
+                frame_sample, self.gst_sen_inp, descriptor
+            )
+            return input_img, frame, input_img.pts
+
+        loop = self.sub_flow.input.loop
+        while True:
+            item = self.gst_pipe.pull_sample(self.gst_pre_inp, loop)
+            if item == None:
+                return None
+            tensor_sample, _ = item
+            frame_item = None
+            if not self.headless:
+                frame_item = self.gst_pipe.pull_sample(self.gst_sen_inp, loop)
+                if frame_item == None:
+                    return None
+            # The sensor frame pulled along with a stale tensor is dropped
+            # too, else the frames fall one sample behind the tensors
+            if not self.is_stale(tensor_sample):
+                break
+        input_img = self.get_tensor(tensor_sample)
+        if self.headless:
+            return input_img, None, input_img.pts
+        frame_sample, descriptor = frame_item
+        frame = self.gst_pipe.frame_from_sample(
+            frame_sample, self.gst_sen_inp, descriptor
+        )
+        return input_img, frame, input_img.pts
+
+    def infer(self, input_img):
+        """
+        Run inference on the tensor and report the time taken.
+        Returns None if the frame is not inferred due to infer_interval or
+        because the scene has not changed, so that post processing predicts
+        the results of the frame instead of decoding the last ones again.
+        Args:
+            input_img: pre-processed input tensor
+        """
+        # Infer only every infer_interval frames
+        frame_index = self.frame_index
+        self.frame_index += 1
+        if frame_index % self.infer_interval != 0 and self.last_result is not None:
+            self.sub_flow.report.report_count("interpolated frames")
+            return None
+
+        # Skip inference if the scene has not changed
+        if self.motion_gate:
+            changed = self.motion_gate.is_changed(input_img)
+            if not changed and self.last_result is not None:
+                self.sub_flow.report.report_count("skipped frames")
+                return None
+            self.sub_flow.report.report_count("inferred frames")
+
+        start = time()
+        if self.broker:
+            result = self.broker.infer(input_img)
+        else:
+            result = self.run_time(input_img)
+        end = time()
+        self.sub_flow.report.report_proctime("dl-inference", (end - start))
+
+        if self.infer_debug:
+            self.infer_debug.log(str(result))
+
+        self.last_result = result
+        return result
+
+    def post_process(self, frame, result, pts=None):
+        """
+        Post process the frame and push it to the sink pipeline. Decoded
+        results are written to the metadata outputs.
+        Args:
+            frame: sensor frame, None if the subflow has no sensor path
+            result: output of inference, None if the frame is not inferred
+            pts: PTS of the tensor the result is inferred from
+        """
+        decoded = self.post_proc.update(result)
+        if self.metadata_writers:
+            self.write_metadata(decoded, pts)
+        if self.headless:
+            self.sub_flow.report.report_frame()
+            return
+
+        # Capture time of the sensor frame, stamped on the pushed buffer
+        timestamp = getattr(frame, "timestamp", None)
+        if self.post_proc_pool:
+            self.post_proc_pool.submit(frame, decoded, timestamp)
+            # Return the sensor buffer to its pool
+            release_array(frame)
+        else:
+            # Draw directly into the buffer to be pushed
+            out_frame = self.gst_pipe.get_output_frame(self.gst_post_out)
+            np.copyto(out_frame, frame)
+            release_array(frame)
+            if decoded is not None:
+                out_frame = self.post_proc.draw(out_frame, decoded)
+            self.push_frame(out_frame, timestamp)
+
+    def write_metadata(self, decoded, pts):
+        """
+        Write the decoded results of a frame to the metadata outputs
+        Args:
+            decoded: decoded results of the frame
+            pts: PTS of the frame
+        """
+        record = {
+            "flow": self.sub_flow.flow.id,
+            "subflow": self.sub_flow.id,
+            "model": self.sub_flow.model.model_name,
+            "task": self.sub_flow.model.task_type,
+            "pts": pts,
+        }
+        record.update(self.post_proc.get_metadata(decoded))
+        for writer in self.metadata_writers:
+            writer.write(record)
+
+    def push_frame(self, out_frame, timestamp=None):
+        """
+        Push the post-processed frame to the sink pipeline
+        Args:
+            out_frame: post-processed frame
+            timestamp: capture time of the sensor frame
+        """
+        self.gst_pipe.push_frame(out_frame, self.gst_post_out, timestamp)
+        # Increment frame count
+        self.sub_flow.report.report_frame()
+
+    def send_eos(self):
+        """
+        Push the frames pending in post-process workers and send EOS
+        """
+        if self.headless:
+            return
+        if self.post_proc_pool:
+            self.post_proc_pool.flush()
+        self.gst_pipe.send_eos(self.gst_post_out)
 
     def pipeline(self):
         """
@@ -97,37 +406,58 @@ class InferPipe:
         """
         while self.stop_thread == False:
             # capture and pre-process
-            input_img = self.gst_pipe.pull_tensor(
-                self.gst_pre_inp,
-                self.sub_flow.input.loop,
-                self.sub_flow.model.crop[0],
-                self.sub_flow.model.crop[1],
-                self.sub_flow.model.data_layout,
-                self.sub_flow.model.data_type,
-            )
-            if type(input_img) == type(None):
+            data = self.capture()
+            if data == None:
                 break
-
-            if self.pre_proc_debug:
-                self.pre_proc_debug.log(str(input_img.flatten()))
+            input_img, frame, pts = data
 
             # Inference
-            start = time()
-            result = self.run_time(input_img)
-            end = time()
-            self.sub_flow.report.report_proctime("dl-inference", (end - start))
-
-            if self.infer_debug:
-                self.infer_debug.log(str(result))
+            result = self.infer(input_img)
+            release_array(input_img)
 
             # post-process
-            frame = self.gst_pipe.pull_frame(self.gst_sen_inp, self.sub_flow.input.loop)
-            if type(frame) == type(None):
+            self.post_process(frame, result, pts)
+
+        self.stop_thread = False
+        self.send_eos()
+
+    def capture_stage(self):
+        """
+        Callback function for capture thread in staged mode.
+        Pulls the tensor and the frame and hands them to inference stage.
+        None is used to signal the end of stream to the next stage.
+        """
+        while self.stop_thread == False:
+            data = self.capture()
+            if data == None:
                 break
-            out_frame = self.post_proc(frame, result)
-            self.gst_pipe.push_frame(out_frame, self.gst_post_out)
-            # Increment frame count
-            self.sub_flow.report.report_frame()
+            self.infer_queue.put(data)
+        self.infer_queue.put(None)
+
+    def inference_stage(self):
+        """
+        Callback function for inference thread in staged mode
+        """
+        while True:
+            data = self.infer_queue.get()
+            if data == None:
+                break
+            input_img, frame, pts = data
+            result = self.infer(input_img)
+            release_array(input_img)
+            self.post_queue.put((frame, result, pts))
+        self.post_queue.put(None)
+
+    def post_process_stage(self):
+        """
+        Callback function for post-process thread in staged mode
+        """
+        while True:
+            data = self.post_queue.get()
+            if data == None:
+                break
+            frame, result, pts = data
+            self.post_process(frame, result, pts)
 
         self.stop_thread = False
-        self.gst_pipe.send_eos(self.gst_post_out)
+        self.send_eos()
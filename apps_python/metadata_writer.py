@@ -0,0 +1,121 @@
+#  Copyright (C) 2021 Texas Instruments Incorporated - http://www.ti.com/
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import socket
+import sys
+import threading
+
+
+class MetadataWriter:
+    """
+    Class to write the decoded results of flows as records to a file,
+    a unix datagram socket or a udp socket. The location is one of:
+        /path/to/file            records are appended to the file
+        unix:///path/to/socket   each record is sent as a datagram
+        udp://host:port          each record is sent as a datagram
+    Records are serialized as JSON lines or msgpack.
+    """
+
+    def __init__(self, location, format="json"):
+        """
+        Constructor of MetadataWriter class
+        Args:
+            location: where the records are written
+            format: "json" or "msgpack"
+        """
+        self.location = location
+        self.lock = threading.Lock()
+        self.file = None
+        self.socket = None
+        self.address = None
+        self.dropped = 0
+
+        if format == "json":
+            self.serialize = self.to_json
+        elif format == "msgpack":
+            try:
+                import msgpack
+            except ImportError:
+                print("[ERROR] msgpack module is needed for msgpack metadata")
+                sys.exit(1)
+            self.serialize = msgpack.packb
+        else:
+            print("[ERROR] Invalid metadata format %s" % format)
+            sys.exit(1)
+
+        if location.startswith("unix://"):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.address = location[len("unix://") :]
+        elif location.startswith("udp://"):
+            host, _, port = location[len("udp://") :].rpartition(":")
+            if not host or not port.isdigit():
+                print("[ERROR] Invalid metadata location %s" % location)
+                sys.exit(1)
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.address = (host, int(port))
+        else:
+            self.file = open(location, "ab")
+
+    def to_json(self, record):
+        """
+        Serialize a record as a line of JSON
+        Args:
+            record: dictionary to be serialized
+        """
+        return (json.dumps(record) + "\n").encode()
+
+    def write(self, record):
+        """
+        Write a record. Records which can not be sent, for example since
+        no one is listening on the socket, are dropped.
+        Args:
+            record: dictionary of the decoded results of a frame
+        """
+        data = self.serialize(record)
+        with self.lock:
+            if self.file:
+                self.file.write(data)
+                self.file.flush()
+                return
+            try:
+                self.socket.sendto(data, self.address)
+            except OSError:
+                self.dropped += 1
+
+    def close(self):
+        """
+        Close the file or socket
+        """
+        with self.lock:
+            if self.file:
+                self.file.close()
+            if self.socket:
+                self.socket.close()
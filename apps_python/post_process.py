@@ -30,8 +30,10 @@
 
 import cv2
 import numpy as np
-import copy
+from types import SimpleNamespace
 import debug
+from text_sprites import put_text
+from tracker import BoxTracker
 
 np.set_printoptions(threshold=np.inf, linewidth=np.inf)
 
@@ -69,6 +71,28 @@ def overlay_model_name(frame, model_name, start_x, start_y, width, height):
     return frame
 
 
+def get_draw_context(flow):
+    """
+    Returns the picklable subset of a subflow needed to draw its decoded
+    results, used to create PostProcess objects in worker processes
+    without the model and its runtime
+    Args:
+        flow: subflow configuration
+    """
+    model = flow.model
+    model_info = SimpleNamespace(
+        task_type=model.task_type,
+        classnames=getattr(model, "classnames", None),
+        label_offset=getattr(model, "label_offset", 0),
+        topN=getattr(model, "topN", None),
+        alpha=getattr(model, "alpha", None),
+        palette=getattr(model, "palette", None),
+        tracker=getattr(model, "tracker", None),
+        infer_interval=1,
+    )
+    return SimpleNamespace(model=model_info, debug_config=None)
+
+
 class PostProcess:
     """
     Class to create a post process context
@@ -79,6 +103,7 @@ class PostProcess:
         self.model = flow.model
         self.debug = None
         self.debug_str = ""
+        self.last_decoded = None
         if flow.debug_config and flow.debug_config.post_proc:
             self.debug = debug.Debug(flow.debug_config, "post")
 
@@ -93,20 +118,85 @@ class PostProcess:
         elif flow.model.task_type == "segmentation":
             return PostProcessSegmentation(flow)
 
+    def __call__(self, img, results):
+        """
+        Post process function. Decodes the results and draws them on
+        the frame
+        Args:
+            img: Input frame
+            results: output of inference, None if the frame is not inferred
+        """
+        decoded = self.update(results)
+        if decoded is None:
+            return img
+        return self.draw(img, decoded)
+
+    def update(self, results):
+        """
+        Returns the decoded results of the current frame
+        Args:
+            results: output of inference, None if the frame is not inferred
+        """
+        if results is None:
+            decoded = self.predict()
+        else:
+            decoded = self.decode(results)
+        self.last_decoded = decoded
+        return decoded
+
+    def predict(self):
+        """
+        Returns the decoded results to be used for a frame which is not
+        inferred. By default results of last inferred frame are used.
+        """
+        return self.last_decoded
+
+    def get_metadata(self, decoded):
+        """
+        Returns the decoded results as a dictionary of plain python
+        types, to be written by metadata outputs
+        Args:
+            decoded: decoded results of a frame, None if not available
+        """
+        return {}
+
 
 class PostProcessClassification(PostProcess):
     def __init__(self, flow):
         super().__init__(flow)
 
-    def __call__(self, img, results):
+    def decode(self, results):
         """
-        Post process function for classification
+        Decode the results of classification to topN class indices
         Args:
-            img: Input frame
             results: output of inference
         """
         results = np.squeeze(results)
-        img = self.overlay_topN_classnames(img, results)
+        N = self.model.topN
+        return np.argsort(results)[: (-1 * N) - 1 : -1]
+
+    def get_metadata(self, topN_classes):
+        """
+        Returns the topN class indices and their names
+        Args:
+            topN_classes: decoded topN class indices
+        """
+        if topN_classes is None:
+            return {"topN": [], "labels": []}
+        labels = [
+            self.model.classnames.get(idx + self.model.label_offset)
+            for idx in topN_classes
+        ]
+        return {"topN": topN_classes.tolist(), "labels": labels}
+
+    def draw(self, img, topN_classes):
+        """
+        Draw function for classification
+        Args:
+            img: Input frame
+            topN_classes: decoded topN class indices
+        """
+        img = self.overlay_topN_classnames(img, topN_classes)
 
         if self.debug:
             self.debug.log(self.debug_str)
@@ -114,7 +204,7 @@ class PostProcessClassification(PostProcess):
 
         return img
 
-    def overlay_topN_classnames(self, frame, results):
+    def overlay_topN_classnames(self, frame, topN_classes):
         """
         Process the results of the image classification model and draw text
         describing top 5 detected objects on the image.
@@ -122,15 +212,14 @@ class PostProcessClassification(PostProcess):
         Args:
             frame (numpy array): Input image in BGR format where the overlay should
         be drawn
-            results (numpy array): Output of the model run
+            topN_classes (numpy array): Indices of topN classes
         """
         orig_width = frame.shape[1]
         orig_height = frame.shape[0]
         row_size = 40 * orig_width // 1280
         font_size = orig_width / 1280
         N = self.model.topN
-        topN_classes = np.argsort(results)[: (-1 * N) - 1 : -1]
-        cv2.putText(
+        put_text(
             frame,
             "Recognized Classes (Top %d):" % N,
             (5, 2 * row_size),
@@ -142,7 +231,7 @@ class PostProcessClassification(PostProcess):
         row = 3
         for idx in topN_classes:
             class_name = self.model.classnames.get(idx + self.model.label_offset)
-            cv2.putText(
+            put_text(
                 frame,
                 class_name,
                 (5, row_size * row),
@@ -161,51 +250,144 @@ class PostProcessClassification(PostProcess):
 class PostProcessDetection(PostProcess):
     def __init__(self, flow):
         super().__init__(flow)
+        self.tracker = None
+        self.show_track_ids = False
+        tracker_config = getattr(self.model, "tracker", None)
+        if tracker_config:
+            if type(tracker_config) != dict:
+                tracker_config = {}
+            self.tracker = BoxTracker(**tracker_config)
+            self.show_track_ids = True
+        elif self.model.infer_interval > 1:
+            self.tracker = BoxTracker()
+        # Column gathers of the formatter, computed per number of columns
+        self.columns = {}
+        self.class_names = self.get_class_names()
+
+    def get_columns(self, num_columns):
+        """
+        Returns the indices of the columns of the concatenated output
+        which form [X1 Y1 X2 Y2 class score], applying the formatter
+        Args:
+            num_columns: number of columns in the concatenated output
+        """
+        if num_columns in self.columns:
+            return self.columns[num_columns]
+        columns = np.arange(num_columns)
+        if self.model.formatter:
+            kept = columns
+            if self.model.ignore_index != None:
+                kept = np.delete(columns, self.model.ignore_index)
+            columns = columns.copy()
+            columns[self.model.formatter["dst_indices"]] = kept[
+                self.model.formatter["src_indices"]
+            ]
+        columns = columns[:6]
+        self.columns[num_columns] = columns
+        return columns
 
-    def __call__(self, img, results):
+    def get_class_names(self):
         """
-        Post process function for detection
+        Returns an array mapping the class index of a box to its name,
+        applying label_offset. Indices with no name map to None.
+        """
+        label_offset = self.model.label_offset
+        classnames = self.model.classnames
+        if type(label_offset) == dict:
+            names = {int(k): classnames.get(v) for k, v in label_offset.items()}
+        else:
+            names = {int(k) - label_offset: v for k, v in classnames.items()}
+        names = {k: v for k, v in names.items() if k >= 0}
+        class_names = np.full(max(names, default=-1) + 1, None, object)
+        for k, v in names.items():
+            class_names[k] = v
+        return class_names
+
+    def decode(self, results):
+        """
+        Decode the results of detection to boxes above viz_threshold
+        in format [X1 Y1 X2 Y2 class score] normalized to frame size
         Args:
-            img: Input frame
             results: output of inference
         """
-        for i, r in enumerate(results):
-            r = np.squeeze(r)
-            if r.ndim == 1:
-                r = np.expand_dims(r, 1)
-            results[i] = r
+        results = [np.squeeze(r) for r in results]
+        results = [np.expand_dims(r, 1) if r.ndim == 1 else r for r in results]
 
         if self.model.shuffle_indices:
-            results_reordered = []
-            for i in self.model.shuffle_indices:
-                results_reordered.append(results[i])
-            results = results_reordered
+            results = [results[i] for i in self.model.shuffle_indices]
 
         if results[-1].ndim < 2:
             results = results[:-1]
 
         bbox = np.concatenate(results, axis=-1)
+        columns = self.get_columns(bbox.shape[-1])
 
-        if self.model.formatter:
-            if self.model.ignore_index == None:
-                bbox_copy = copy.deepcopy(bbox)
-            else:
-                bbox_copy = copy.deepcopy(np.delete(bbox, self.model.ignore_index, 1))
-            bbox[..., self.model.formatter["dst_indices"]] = bbox_copy[
-                ..., self.model.formatter["src_indices"]
-            ]
+        # Threshold before gathering so that only the kept boxes are copied
+        bbox = bbox[bbox[..., columns[5]] > self.model.viz_threshold]
+        bbox = bbox[:, columns].astype(np.float32)
 
         if not self.model.normalized_detections:
-            bbox[..., (0, 2)] /= self.model.resize[0]
-            bbox[..., (1, 3)] /= self.model.resize[1]
+            bbox[:, (0, 2)] /= self.model.resize[0]
+            bbox[:, (1, 3)] /= self.model.resize[1]
 
-        for b in bbox:
-            if b[5] > self.model.viz_threshold:
-                if type(self.model.label_offset) == dict:
-                    class_name = self.model.classnames[self.model.label_offset[int(b[4])]]
-                else:
-                    class_name = self.model.classnames[self.model.label_offset + int(b[4])]
-                img = self.overlay_bounding_box(img, b, class_name)
+        if self.tracker:
+            bbox = self.tracker.update(bbox)
+
+        return bbox
+
+    def predict(self):
+        """
+        Carry the boxes forward with their estimated velocity for a frame
+        which is not inferred
+        """
+        if self.tracker:
+            return self.tracker.predict()
+        return self.last_decoded
+
+    def get_labels(self, bbox):
+        """
+        Returns the boxes whose class has a name, and the names
+        Args:
+            bbox: decoded boxes
+        """
+        classes = bbox[:, 4].astype(np.int64)
+        valid = (classes >= 0) & (classes < len(self.class_names))
+        names = np.full(len(bbox), None, object)
+        names[valid] = self.class_names[classes[valid]]
+        named = names != None
+        return bbox[named], names[named]
+
+    def get_metadata(self, bbox):
+        """
+        Returns the boxes, classes, scores and class names
+        Args:
+            bbox: decoded boxes
+        """
+        if bbox is None:
+            bbox = np.zeros((0, 7), np.float32)
+        bbox, names = self.get_labels(bbox)
+        metadata = {
+            "boxes": bbox[:, :4].tolist(),
+            "classes": bbox[:, 4].astype(np.int64).tolist(),
+            "scores": bbox[:, 5].tolist(),
+            "labels": names.tolist(),
+        }
+        if self.show_track_ids:
+            metadata["tracks"] = bbox[:, 6].astype(np.int64).tolist()
+        return metadata
+
+    def draw(self, img, bbox):
+        """
+        Draw function for detection
+        Args:
+            img: Input frame
+            bbox: decoded boxes
+        """
+        # Skip boxes of classes which have no name
+        for b, class_name in zip(*self.get_labels(bbox)):
+            if self.show_track_ids:
+                class_name = "%s #%d" % (class_name, int(b[6]))
+            img = self.overlay_bounding_box(img, b, class_name)
 
         if self.debug:
             self.debug.log(self.debug_str)
@@ -238,13 +420,14 @@ class PostProcessDetection(PostProcess):
             box_color,
             -1,
         )
-        cv2.putText(
+        put_text(
             frame,
             class_name,
             (int((box[2] + box[0]) / 2), int((box[3] + box[1]) / 2)),
             cv2.FONT_HERSHEY_SIMPLEX,
             0.5,
             text_color,
+            volatile=self.show_track_ids,
         )
 
         if self.debug:
@@ -255,65 +438,102 @@ class PostProcessDetection(PostProcess):
 
 
 class PostProcessSegmentation(PostProcess):
-    def __call__(self, img, results):
+    def __init__(self, flow):
+        super().__init__(flow)
+        self.palette = self.get_palette()
+        # Buffers reused across frames, allocated for the frame size
+        self.index_map = None
+        self.mask_image = None
+
+    def get_palette(self):
+        """
+        Returns a (256, 3) uint8 array mapping class index to RGB color.
+        Classes not in the configured palette use the default colors.
         """
-        Post process function for segmentation
+        index = np.arange(256, dtype=np.uint32)[:, None]
+        palette = (index * np.array([10, 20, 30], np.uint32)).astype(np.uint8)
+        if getattr(self.model, "palette", None):
+            colors = np.array(self.model.palette, np.uint8).reshape(-1, 3)[:256]
+            palette[: len(colors)] = colors
+        return palette
+
+    def decode(self, results):
+        """
+        Decode the results of segmentation to the class index map
         Args:
-            img: Input frame
             results: output of inference
         """
-        img = self.blend_segmentation_mask(img, results[0])
+        mask = np.squeeze(results[0])
+
+        if len(mask.shape) > 2:
+            mask = mask[0]
+
+        return mask
+
+    def get_metadata(self, mask):
+        """
+        Returns the classes present in the class index map. The map
+        itself is not written.
+        Args:
+            mask: decoded class index map
+        """
+        if mask is None:
+            return {"classes": []}
+        return {"classes": np.unique(mask).astype(np.int64).tolist()}
+
+    def draw(self, img, mask):
+        """
+        Draw function for segmentation
+        Args:
+            img: Input frame
+            mask: decoded class index map
+        """
+        img = self.blend_segmentation_mask(img, mask)
 
         return img
 
-    def blend_segmentation_mask(self, frame, results):
+    def blend_segmentation_mask(self, frame, mask):
         """
         Process the result of the semantic segmentation model and return
         an image color blended with the mask representing different color
-        for each class
+        for each class. The frame is blended in place.
 
         Args:
             frame (numpy array): Input image in BGR format which should be blended
-            results (numpy array): Results of the model run
+            mask (numpy array): Class index map decoded from the model output
         """
-
-        mask = np.squeeze(results)
-
-        if len(mask.shape) > 2:
-            mask = mask[0]
-
         if self.debug:
             self.debug_str += str(mask.flatten()) + "\n"
             self.debug.log(self.debug_str)
             self.debug_str = ""
 
-        # Resize the mask to the original image for blending
-        org_image_rgb = frame
-        org_width = frame.shape[1]
-        org_height = frame.shape[0]
-
-        mask_image_rgb = self.gen_segment_mask(mask)
-        mask_image_rgb = cv2.resize(
-            mask_image_rgb, (org_width, org_height), interpolation=cv2.INTER_LINEAR
+        org_height, org_width = frame.shape[:2]
+        if self.index_map is None or self.index_map.shape != (org_height, org_width):
+            self.index_map = np.empty((org_height, org_width), np.uint8)
+            self.mask_image = np.empty((org_height, org_width, 3), np.uint8)
+
+        # Resize the class indices to the original image before colorizing
+        cv2.resize(
+            mask.astype(np.uint8, copy=False),
+            (org_width, org_height),
+            dst=self.index_map,
+            interpolation=cv2.INTER_NEAREST,
         )
+        self.gen_segment_mask(self.index_map, self.mask_image)
 
-        blend_image = cv2.addWeighted(
-            mask_image_rgb, 1 - self.model.alpha, org_image_rgb, self.model.alpha, 0
+        cv2.addWeighted(
+            self.mask_image, 1 - self.model.alpha, frame, self.model.alpha, 0, dst=frame
         )
 
-        return blend_image
+        return frame
 
-    def gen_segment_mask(self, inp):
+    def gen_segment_mask(self, inp, out=None):
         """
         Generate the segmentation mask from the result of semantic segmentation
         model. Creates an RGB image with different colors for each class.
 
         Args:
-            inp (numpy array): Result of the model run
+            inp (numpy array): uint8 class index map
+            out (numpy array): RGB image to write the mask to, allocated if None
         """
-
-        r_map = (inp * 10).astype(np.uint8)
-        g_map = (inp * 20).astype(np.uint8)
-        b_map = (inp * 30).astype(np.uint8)
-
-        return cv2.merge((r_map, g_map, b_map))
+        return np.take(self.palette, inp, axis=0, out=out, mode="clip")
@@ -0,0 +1,237 @@
+#  Copyright (C) 2021 Texas Instruments Incorporated - http://www.ti.com/
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+import multiprocessing
+import threading
+import traceback
+from queue import Empty
+from multiprocessing import shared_memory
+from post_process import PostProcess
+
+
+def post_process_worker(draw_context, slot_names, shape, task_queue, done_queue):
+    """
+    Entry function of the post-process worker process. Draws the decoded
+    results on the frames placed in shared memory slots by the parent.
+    Args:
+        draw_context: context returned by post_process.get_draw_context
+        slot_names: Names of shared memory frame slots
+        shape: Shape of the frame held in a slot
+        task_queue: Queue to receive (seq, slot, decoded) from parent
+        done_queue: Queue to send back (seq, slot, error) when done, error
+                    is the traceback if drawing failed, the worker exits then
+    """
+    post_proc = PostProcess.get(draw_context)
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    frames = [np.ndarray(shape, np.uint8, slot.buf) for slot in slots]
+    while True:
+        task = task_queue.get()
+        if task == None:
+            break
+        seq, index, decoded = task
+        frame = frames[index]
+        try:
+            out_frame = post_proc.draw(frame, decoded)
+            if out_frame is not frame:
+                np.copyto(frame, out_frame)
+        except Exception:
+            done_queue.put((seq, index, traceback.format_exc()))
+            break
+        done_queue.put((seq, index, None))
+    del frames
+    for slot in slots:
+        slot.close()
+
+
+class PostProcessPool:
+    """
+    Class to run the drawing part of post-processing in worker processes
+    so that it does not contend for the GIL with the InferPipe threads.
+    Frames are exchanged through shared memory slots, only the decoded
+    results are pickled. Processed frames are handed to push in order
+    from a receiver thread as soon as they are done.
+    """
+
+    def __init__(self, draw_context, num_workers, width, height, push):
+        """
+        Constructor of PostProcessPool class
+        Args:
+            draw_context: context returned by post_process.get_draw_context
+            num_workers: Number of worker processes
+            width: width of the frame
+            height: height of the frame
+            push: function called with each processed frame and its
+                  timestamp, in order
+        """
+        self.push = push
+        self.shape = (height, width, 3)
+        num_slots = 2 * num_workers
+        self.slots = [
+            shared_memory.SharedMemory(create=True, size=width * height * 3)
+            for i in range(num_slots)
+        ]
+        self.frames = [np.ndarray(self.shape, np.uint8, s.buf) for s in self.slots]
+        self.free_slots = list(range(num_slots))
+        self.done = {}
+        self.timestamps = {}
+        self.next_seq = 0
+        self.push_seq = 0
+        # Guards the slot and sequence state shared with receiver thread
+        self.cond = threading.Condition()
+        # Set by receiver thread if a worker failed, raised by submit/flush
+        self.error = None
+        self.closing = False
+
+        # Spawn since forking the multithreaded process can deadlock workers
+        context = multiprocessing.get_context("spawn")
+        self.task_queue = context.Queue()
+        self.done_queue = context.Queue()
+        slot_names = [s.name for s in self.slots]
+        self.workers = [
+            context.Process(
+                target=post_process_worker,
+                args=(
+                    draw_context,
+                    slot_names,
+                    self.shape,
+                    self.task_queue,
+                    self.done_queue,
+                ),
+                daemon=True,
+            )
+            for i in range(num_workers)
+        ]
+        for w in self.workers:
+            w.start()
+        self.receiver = threading.Thread(target=self.receive, daemon=True)
+        self.receiver.start()
+
+    def submit(self, frame, decoded, timestamp=None):
+        """
+        Copy the frame to a free slot and queue it to the workers.
+        Blocks till a slot is free if all the slots are in use.
+        Args:
+            frame: sensor frame
+            decoded: decoded results to be drawn on the frame
+            timestamp: capture time of the frame, handed back to push
+        """
+        with self.cond:
+            while len(self.free_slots) == 0 and self.error == None:
+                self.cond.wait(1)
+            self.check_error()
+            index = self.free_slots.pop()
+            seq = self.next_seq
+            self.next_seq += 1
+            self.timestamps[seq] = timestamp
+        np.copyto(self.frames[index], frame)
+        self.task_queue.put((seq, index, decoded))
+
+    def receive(self):
+        """
+        Callback function for receiver thread. Receives the frames
+        processed by workers and pushes the ones which are next in order.
+        """
+        while True:
+            try:
+                task = self.done_queue.get(timeout=1)
+            except Empty:
+                # A killed worker never reports its frame
+                dead = [w for w in self.workers if not w.is_alive()]
+                if dead and not self.closing:
+                    self.fail(
+                        "Post-process worker exited with code %s" % dead[0].exitcode
+                    )
+                    break
+                continue
+            if task == None:
+                break
+            seq, index, error = task
+            if error != None:
+                self.fail("Post-process worker failed\n" + error)
+                break
+            with self.cond:
+                self.done[seq] = index
+            while True:
+                with self.cond:
+                    if self.push_seq not in self.done:
+                        break
+                    index = self.done.pop(self.push_seq)
+                    timestamp = self.timestamps.pop(self.push_seq)
+                self.push(self.frames[index], timestamp)
+                with self.cond:
+                    self.free_slots.append(index)
+                    self.push_seq += 1
+                    self.cond.notify_all()
+
+    def fail(self, error):
+        """
+        Record the failure of a worker and wake up submit and flush
+        Args:
+            error: description of the failure
+        """
+        print("[ERROR] %s" % error)
+        with self.cond:
+            self.error = error
+            self.cond.notify_all()
+
+    def check_error(self):
+        """
+        Raise RuntimeError if a worker failed, frames submitted to it
+        would never be pushed
+        """
+        if self.error != None:
+            raise RuntimeError(self.error)
+
+    def flush(self):
+        """
+        Wait for all the submitted frames to be processed and pushed.
+        Raises RuntimeError if a worker failed.
+        """
+        with self.cond:
+            while self.push_seq < self.next_seq and self.error == None:
+                self.cond.wait(1)
+            self.check_error()
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory slots
+        """
+        self.closing = True
+        for w in self.workers:
+            self.task_queue.put(None)
+        for w in self.workers:
+            w.join()
+        self.done_queue.put(None)
+        self.receiver.join()
+        del self.frames
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
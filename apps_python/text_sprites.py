@@ -0,0 +1,165 @@
+#  Copyright (C) 2021 Texas Instruments Incorporated - http://www.ti.com/
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import cv2
+import numpy as np
+import threading
+from collections import OrderedDict
+
+
+class TextSpriteCache:
+    """
+    LRU cache of text rendered once by cv2.putText. Cached labels are
+    blitted on the frames as masks with numpy slicing, which is much
+    faster than rasterizing the glyphs every frame. Text which changes
+    every frame, like counts, costs or track ids, is drawn as volatile
+    from sprites of its characters so that it does not churn the cache.
+    The cache is shared by the drawing threads and guarded by a lock.
+    """
+
+    def __init__(self, max_size=512):
+        """
+        Constructor of TextSpriteCache class
+        Args:
+            max_size: Max number of sprites kept in the cache
+        """
+        self.max_size = max_size
+        self.sprites = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, text, font, scale, color, thickness):
+        """
+        Returns the sprite of the text as (mask, color, offset, advance)
+        where offset is the position of the text origin in the mask and
+        advance is the width of the text
+        Args:
+            text: text to be rendered
+            font: cv2 font face
+            scale: font scale
+            color: color of the text
+            thickness: thickness of the strokes
+        """
+        key = (text, font, scale, tuple(color), thickness)
+        with self.lock:
+            sprite = self.sprites.get(key)
+            if sprite is not None:
+                self.sprites.move_to_end(key)
+                return sprite
+
+        (width, height), baseline = cv2.getTextSize(text, font, scale, thickness)
+        pad = thickness
+        canvas = np.zeros((height + baseline + 2 * pad, width + 2 * pad), np.uint8)
+        cv2.putText(canvas, text, (pad, pad + height), font, scale, 255, thickness)
+        color = np.array(color, np.uint8)
+        sprite = (canvas != 0, color, (pad, pad + height), width)
+
+        with self.lock:
+            self.sprites[key] = sprite
+            if len(self.sprites) > self.max_size:
+                self.sprites.popitem(last=False)
+        return sprite
+
+    def blit(self, frame, sprite, org):
+        """
+        Draw a sprite on the frame with its origin at org
+        Args:
+            frame: image on which the sprite is drawn
+            sprite: sprite returned by get
+            org: bottom-left corner of the text
+        """
+        mask, color, (offset_x, offset_y), _ = sprite
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        if len(color) != channels:
+            raise ValueError(
+                "Color %s does not match %d channel frame" % (tuple(color), channels)
+            )
+        x = int(org[0]) - offset_x
+        y = int(org[1]) - offset_y
+        # Clip the sprite to the frame
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + mask.shape[1], frame.shape[1])
+        y1 = min(y + mask.shape[0], frame.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+        mask = mask[y0 - y : y1 - y, x0 - x : x1 - x]
+        region = frame[y0:y1, x0:x1]
+        if region.ndim == 2:
+            region[mask] = color[0]
+        else:
+            region[mask] = color
+
+    def put_text(self, frame, text, org, font, scale, color, thickness=1, volatile=False):
+        """
+        Draw the text on the frame like cv2.putText. Returns the frame.
+        Args:
+            frame: image on which the text is drawn
+            text: text to be drawn
+            org: bottom-left corner of the text
+            font: cv2 font face
+            scale: font scale
+            color: color of the text
+            thickness: thickness of the strokes
+            volatile: Draw from sprites of the characters instead of
+                      caching the whole text
+        """
+        if not volatile:
+            sprite = self.get(text, font, scale, color, thickness)
+            self.blit(frame, sprite, org)
+            return frame
+
+        x, y = int(org[0]), int(org[1])
+        for char in text:
+            sprite = self.get(char, font, scale, color, thickness)
+            self.blit(frame, sprite, (x, y))
+            x += sprite[3]
+        return frame
+
+
+text_sprites = TextSpriteCache()
+
+
+def put_text(frame, text, org, font, scale, color, thickness=1, volatile=False):
+    """
+    Draw the text on the frame using the shared sprite cache
+    Args:
+        frame: image on which the text is drawn
+        text: text to be drawn
+        org: bottom-left corner of the text
+        font: cv2 font face
+        scale: font scale
+        color: color of the text
+        thickness: thickness of the strokes
+        volatile: Text changes every frame, draw it from character sprites
+    """
+    return text_sprites.put_text(
+        frame, text, org, font, scale, color, thickness, volatile
+    )
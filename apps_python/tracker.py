@@ -0,0 +1,183 @@
+#  Copyright (C) 2021 Texas Instruments Incorporated - http://www.ti.com/
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Returns the IoU of every box in boxes_a with every box in boxes_b
+    Args:
+        boxes_a: (N, 4+) array of boxes in format [X1 Y1 X2 Y2 ...]
+        boxes_b: (M, 4+) array of boxes in format [X1 Y1 X2 Y2 ...]
+    """
+    a = boxes_a[:, None, :4]
+    b = boxes_b[None, :, :4]
+    x1 = np.maximum(a[..., 0], b[..., 0])
+    y1 = np.maximum(a[..., 1], b[..., 1])
+    x2 = np.minimum(a[..., 2], b[..., 2])
+    y2 = np.minimum(a[..., 3], b[..., 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+class BoxTracker:
+    """
+    IoU tracker assigning persistent ids to the detections. Tracks move
+    with constant velocity, which is used to carry the detections forward
+    on frames which are not inferred and to coast tracks through missed
+    detections. Boxes are returned in format
+    [X1 Y1 X2 Y2 class score track_id]
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=0, min_hits=1):
+        """
+        Constructor of BoxTracker class
+        Args:
+            iou_threshold: Min IoU for a detection to continue a track
+            max_age: Number of inferred frames a track is kept without a
+                     matching detection
+            min_hits: Number of detections after which a track is reported
+        """
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.boxes = np.zeros((0, 7), np.float32)
+        self.velocity = np.zeros((0, 4), np.float32)
+        # Position at last detection and frames elapsed since then
+        self.last = np.zeros((0, 4), np.float32)
+        self.since_update = np.zeros(0, np.int32)
+        self.misses = np.zeros(0, np.int32)
+        self.hits = np.zeros(0, np.int32)
+        self.next_id = 0
+
+    def match(self, boxes, predicted):
+        """
+        Greedily match detections to tracks in order of IoU. Returns the
+        indices of matched detections and tracks.
+        Args:
+            boxes: (N, 6) array of detections
+            predicted: (M, 7) array of tracks at the current frame
+        """
+        if len(boxes) == 0 or len(predicted) == 0:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        iou = iou_matrix(boxes, predicted)
+        iou[boxes[:, None, 4] != predicted[None, :, 4]] = 0
+        rows, cols = np.nonzero(iou >= self.iou_threshold)
+        order = np.argsort(-iou[rows, cols], kind="stable")
+        det_used = np.zeros(len(boxes), bool)
+        track_used = np.zeros(len(predicted), bool)
+        det_index, track_index = [], []
+        for r, c in zip(rows[order], cols[order]):
+            if det_used[r] or track_used[c]:
+                continue
+            det_used[r] = True
+            track_used[c] = True
+            det_index.append(r)
+            track_index.append(c)
+        return np.array(det_index, np.int64), np.array(track_index, np.int64)
+
+    def update(self, boxes):
+        """
+        Update the tracks with detections of an inferred frame. Matched
+        tracks take the detection and re-estimate their per frame
+        velocity, unmatched tracks coast and detections not matched to a
+        track start new tracks.
+        Args:
+            boxes: (N, 6) array of boxes in format [X1 Y1 X2 Y2 class score]
+        """
+        boxes = np.array(boxes[:, :6], np.float32)
+        # Move the tracks to the current frame
+        predicted = self.boxes.copy()
+        predicted[:, :4] += self.velocity
+        self.since_update += 1
+
+        det_index, track_index = self.match(boxes, predicted)
+
+        # Continue matched tracks
+        elapsed = self.since_update[track_index, None]
+        self.velocity[track_index] = (
+            boxes[det_index, :4] - self.last[track_index]
+        ) / elapsed
+        predicted[track_index, :6] = boxes[det_index]
+        self.last[track_index] = boxes[det_index, :4]
+        self.since_update[track_index] = 0
+        self.misses[track_index] = 0
+        self.hits[track_index] += 1
+
+        # Coast unmatched tracks till max_age
+        unmatched = np.ones(len(predicted), bool)
+        unmatched[track_index] = False
+        self.misses[unmatched] += 1
+        keep = self.misses <= self.max_age
+        self.boxes = predicted[keep]
+        self.velocity = self.velocity[keep]
+        self.last = self.last[keep]
+        self.since_update = self.since_update[keep]
+        self.misses = self.misses[keep]
+        self.hits = self.hits[keep]
+
+        # Start new tracks
+        new = np.ones(len(boxes), bool)
+        new[det_index] = False
+        new_boxes = boxes[new]
+        count = len(new_boxes)
+        ids = np.arange(self.next_id, self.next_id + count, dtype=np.float32)
+        self.next_id += count
+        self.boxes = np.concatenate(
+            [self.boxes, np.concatenate([new_boxes, ids[:, None]], axis=1)]
+        )
+        self.velocity = np.concatenate(
+            [self.velocity, np.zeros((count, 4), np.float32)]
+        )
+        self.last = np.concatenate([self.last, new_boxes[:, :4]])
+        self.since_update = np.concatenate(
+            [self.since_update, np.zeros(count, np.int32)]
+        )
+        self.misses = np.concatenate([self.misses, np.zeros(count, np.int32)])
+        self.hits = np.concatenate([self.hits, np.ones(count, np.int32)])
+
+        return self.get_boxes()
+
+    def predict(self):
+        """
+        Move the tracks by their velocity for a frame which is not inferred
+        """
+        self.boxes[:, :4] += self.velocity
+        self.since_update += 1
+        return self.get_boxes()
+
+    def get_boxes(self):
+        """
+        Returns the tracks which are confirmed by min_hits detections
+        """
+        return self.boxes[self.hits >= self.min_hits]
@@ -45,6 +45,18 @@ import os
 report_list = []
 print_stdout = False
 stop_reporting_loop = False
+# Defaults of the command line options, replaced by get_cmdline_args, so that
+# modules can read them when used without parsing the command line
+args = argparse.Namespace(
+    config="",
+    no_curses=False,
+    verbose=False,
+    dump_dot=False,
+    reprobe=False,
+    replan=False,
+    explain_plan=False,
+    control_socket=None,
+)
 
 
 class Parser(argparse.ArgumentParser):
@@ -89,6 +101,42 @@ def get_cmdline_args(sysv_args):
         "-d", "--dump-dot", help=help_str_dump_dot, action="store_true", default=False
     )
 
+    help_str_reprobe = (
+        "Probe input formats again instead of using cached ones. Implies\n"
+        + "--replan, since a cached plan skips probing\n"
+        + "default: Disabled"
+    )
+    parser.add_argument(
+        "-r", "--reprobe", help=help_str_reprobe, action="store_true", default=False
+    )
+
+    help_str_replan = (
+        "Resolve pipeline plan again instead of using the cached one\n"
+        + "default: Disabled"
+    )
+    parser.add_argument(
+        "-p", "--replan", help=help_str_replan, action="store_true", default=False
+    )
+
+    help_str_explain_plan = (
+        "Print the resolved pipeline plan and exit\n" + "default: Disabled"
+    )
+    parser.add_argument(
+        "-e",
+        "--explain-plan",
+        help=help_str_explain_plan,
+        action="store_true",
+        default=False,
+    )
+
+    help_str_control_socket = (
+        "Path of unix socket to attach and detach flows at runtime\n"
+        + "default: Disabled"
+    )
+    parser.add_argument(
+        "-c", "--control-socket", help=help_str_control_socket, default=None
+    )
+
     args = parser.parse_args()
     return args
 
@@ -97,6 +145,9 @@ class Report:
     def __init__(self, flow):
         self._proctime = {}
         self._metrics = {}
+        self._counters = {}
+        # Counts are reported from pairer, supervisor and inference threads
+        self._counters_lock = threading.Lock()
         self.frame_count = 0
         self.start_time = 0
         self.flow = flow
@@ -127,6 +178,26 @@ class Report:
                     % (self.flow.model.model_name, tag, value * 1000, avg * 1000)
                 )
 
+    def report_count(self, tag, count=1, unit="frames"):
+        """
+        Used for reporting the number of occurrences of an event
+        All the counts with same tag are accumulated
+        This information is used when printing the ncurses table
+
+        Args:
+            tag (string): unique tag to indicate specific event
+            count (int): Number of occurrences to add
+            unit (string): Unit of the count, empty if it has none
+        """
+        with self._counters_lock:
+            total = self._counters.get(tag, (0, unit))[0] + count
+            self._counters[tag] = (total, unit)
+        if print_stdout:
+            print(
+                "[UTILS] [%s] Count '%s': %d %s"
+                % (self.flow.model.model_name, tag, total, unit)
+            )
+
     def report_frame(self):
         """
         Function to be called at the end of each frame
@@ -222,6 +293,12 @@ def reporting_loop(demo_title):
                 stdscr.addstr(i, 55, " from {:^5d}  samples ".format(n))
                 stdscr.addstr(i, last_pos, "|")
                 i = i + 1
+            # Event counts
+            for tag, (count, unit) in list(report._counters.items()):
+                stdscr.addstr(i, 1, "| {:<32s} :".format(tag))
+                stdscr.addstr(i, 42, "{:>8d} {}".format(count, unit), curses.A_BOLD)
+                stdscr.addstr(i, last_pos, "|")
+                i = i + 1
             stdscr.addstr(i, 1, "+%s+" % ("-" * (last_pos - 2)))
             if (y - i) < 12:
                 break
@@ -472,15 +549,15 @@ def print_sink_pipeline(pipeline, mosaic_prop, title=None):
         mosaic_prop(dict): Dictionary containing mosaic property
         title(string): Title given to the flow
     """
-    num = 0
     mosaic_list, mosaic_pad_count = [], []
-    while 1:
-        appsrc = pipeline.get_by_name("post_%d" % (num))
-        if not appsrc:
-            break
+    # Subflows with only metadata outputs have no appsrc, so ids have gaps
+    appsrcs = [
+        e for e in pipeline.iterate_elements() if e.get_name().startswith("post_")
+    ]
+    appsrcs.sort(key=lambda e: int(e.get_name()[len("post_") :]))
+    for appsrc in appsrcs:
         string = print_single_appsrc(pipeline, appsrc, mosaic_list, mosaic_pad_count)
         print(string)
-        num += 1
 
     for mosaic in mosaic_list:
         mosaic_name = mosaic.get_name()
@@ -30,9 +30,15 @@
 
 import numpy as np
 import cv2 as cv
+import os, sys
+from pathlib import Path
 
 import utils
 
+abspath = Path(__file__).parent.absolute()
+sys.path.append(os.path.join(abspath, '../apps_python'))
+from text_sprites import put_text
+
 
 import gi
 gi.require_version('Gst', '1.0')
@@ -44,6 +50,16 @@ RECEIPT_FONT = cv.FONT_HERSHEY_SIMPLEX
 HEADING_FONT = cv.FONT_HERSHEY_TRIPLEX
 
 
+class PooledFrame(np.ndarray):
+    '''
+    Image viewing the mapped memory of a pooled output buffer. The memory is
+    unmapped and the buffer handed over to the appsrc once the frame is pushed,
+    after which the frame must not be drawn to, read or pushed again.
+    '''
+    buffer = None
+    map_info = None
+
+
 class DisplayDrawer():
     '''
     Class to manage the images displayed to the screen. This primarily means the
@@ -64,6 +80,14 @@ class DisplayDrawer():
 
         self.gst_app_out = app_out
         self.gst_caps = gst_caps
+        self.gst_app_out.set_caps(self.gst_caps)
+
+        # preallocated output buffers, recycled once the display releases them
+        self.buffer_pool = Gst.BufferPool.new()
+        config = self.buffer_pool.get_config()
+        Gst.BufferPool.config_set_params(config, gst_caps, screen_width * screen_height * 3, 2, 0)
+        self.buffer_pool.set_config(config)
+        self.buffer_pool.set_active(True)
 
         self.display_all_items = list_receipt_full
 
@@ -71,16 +95,48 @@ class DisplayDrawer():
         self.create_default_receipt_images(classes)
 
 
-    def push_to_display(self, image):
+    def get_output_frame(self, base_image):
         '''
-        Push an image to the display through the appsrc
+        Returns a PooledFrame holding a copy of base_image, drawn into a pooled
+        buffer so that the composed receipt is pushed without another copy
 
-        param image: and image whose dimensions and pixel format matches self.gst_caps
+        param base_image: image the frame starts from, e.g. self.list_image
         '''
+        ret, buffer = self.buffer_pool.acquire_buffer(None)
+        if ret != Gst.FlowReturn.OK:
+            raise RuntimeError('Could not acquire display buffer: %s' % ret.value_nick)
+        _, map_info = buffer.map(Gst.MapFlags.WRITE)
+        frame = np.ndarray(base_image.shape, np.uint8, map_info.data).view(PooledFrame)
+        frame.buffer = buffer
+        frame.map_info = map_info
+        np.copyto(frame, base_image)
+        return frame
 
-        buffer = Gst.Buffer.new_wrapped(image.tobytes())
+    def push_to_display(self, image):
+        '''
+        Push an image to the display through the appsrc
 
-        self.gst_app_out.set_caps(self.gst_caps)
+        param image: and image whose dimensions and pixel format matches self.gst_caps.
+        A PooledFrame from get_output_frame is pushed without copying
+        '''
+        if isinstance(image, PooledFrame):
+            if image.buffer is None:
+                raise ValueError('PooledFrame was already pushed')
+            buffer = image.buffer
+            buffer.unmap(image.map_info)
+            # drop the references so the buffer returns to the pool once downstream is done
+            image.buffer = None
+            image.map_info = None
+        else:
+            # copy straight into the pooled buffer instead of allocating a new one with tobytes()
+            ret, buffer = self.buffer_pool.acquire_buffer(None)
+            if ret != Gst.FlowReturn.OK:
+                raise RuntimeError('Could not acquire display buffer: %s' % ret.value_nick)
+            _, map_info = buffer.map(Gst.MapFlags.WRITE)
+            out = np.ndarray(image.shape, np.uint8, map_info.data)
+            np.copyto(out, image)
+            del out
+            buffer.unmap(map_info)
 
         self.gst_app_out.push_buffer(buffer)
         
@@ -170,11 +226,11 @@ class DisplayDrawer():
             for key in items.keys():
                 item = items[key]
                 start_text_location = (num_x, first_item_y+(50*item['row']))
-                frame = cv.putText(frame, str(item['num']), start_text_location, RECEIPT_FONT, 1.0, black )
+                frame = put_text(frame, str(item['num']), start_text_location, RECEIPT_FONT, 1.0, black, volatile=True)
                 start_text_location = (cost_x, first_item_y+(50*item['row']))
                 cost = item['cost'] * item['num']
                 total += cost
-                frame = cv.putText(frame, '$ %0.2f' % cost, start_text_location, RECEIPT_FONT, 1.0, black )
+                frame = put_text(frame, '$ %0.2f' % cost, start_text_location, RECEIPT_FONT, 1.0, black, volatile=True)
         else:
             start_text_location = (item_x, first_item_y)
 
@@ -183,15 +239,15 @@ class DisplayDrawer():
                 #only draw if at least one of this item was recognized
                 if item['num'] > 0:
                     start_text_location = (item_x, start_text_location[1])
-                    frame = cv.putText(frame, key.upper(), start_text_location, RECEIPT_FONT, 1.0, black )
+                    frame = put_text(frame, key.upper(), start_text_location, RECEIPT_FONT, 1.0, black )
 
                     start_text_location = (num_x, start_text_location[1])
-                    frame = cv.putText(frame, str(item['num']), start_text_location, RECEIPT_FONT, 1.0, black )
+                    frame = put_text(frame, str(item['num']), start_text_location, RECEIPT_FONT, 1.0, black, volatile=True)
 
                     cost = item['cost'] * item['num']
                     total += cost
                     start_text_location = (cost_x, start_text_location[1])
-                    frame = cv.putText(frame, '$ %0.2f' % cost, start_text_location, RECEIPT_FONT, 1.0, black )
+                    frame = put_text(frame, '$ %0.2f' % cost, start_text_location, RECEIPT_FONT, 1.0, black, volatile=True)
 
                     start_text_location = (start_text_location[0], start_text_location[1]+50)
 
@@ -202,7 +258,7 @@ class DisplayDrawer():
 
         # write in the total cost
         start_text_location = (cost_x, frame.shape[0]-20)
-        frame = cv.putText(frame, '$ %.2f' % total, start_text_location, RECEIPT_FONT, 1.0, black, thickness=2)
+        frame = put_text(frame, '$ %.2f' % total, start_text_location, RECEIPT_FONT, 1.0, black, thickness=2, volatile=True)
 
         return frame
             
@@ -218,7 +274,7 @@ class DisplayDrawer():
         '''
         for text in text.split('\n'):
             location = (x, y)
-            frame = cv.putText(frame, text, location, HEADING_FONT, 1.075, color, thickness=3)
+            frame = put_text(frame, text, location, HEADING_FONT, 1.075, color, thickness=3)
             y += 35
 
         return frame
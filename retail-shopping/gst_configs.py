@@ -34,6 +34,8 @@ gi.require_version('GstApp', '1.0')
 from gi.repository import Gst, GstApp, GLib, GObject
 Gst.init(None)
 
+import queue
+
 
 class CamParams():
 
@@ -181,6 +183,41 @@ class GstBuilder():
         self.app_in_tensor = self.pipe.get_by_name(self.appsink_tensor_name)
         self.app_out = self.pipe.get_by_name(self.appsrc_name)
 
+        # samples are handed over from the streaming thread as soon as they arrive
+        self.sample_queues = {}
+        for element in self.pipe.iterate_sinks():
+            factory = element.get_factory()
+            if factory is not None and factory.get_name() == 'appsink':
+                self.connect_appsink(element)
+
+
+    def connect_appsink(self, app):
+        '''
+        Receive samples of the appsink 'app' through its new-sample signal
+        into a queue that pull_sample waits on, instead of polling the appsink
+
+        param app: The appsink obtained from a valid pipeline
+        '''
+        sample_queue = queue.Queue(maxsize=app.get_property('max-buffers'))
+
+        def on_new_sample(appsink):
+            sample = appsink.pull_sample()
+            # mimic drop=true: discard the oldest sample if the app is behind
+            while True:
+                try:
+                    sample_queue.put_nowait(sample)
+                    break
+                except queue.Full:
+                    try:
+                        sample_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+            return Gst.FlowReturn.OK
+
+        app.set_property('emit-signals', True)
+        app.connect('new-sample', on_new_sample)
+        self.sample_queues[app.get_name()] = sample_queue
+
 
     def start_gst(self):
         '''
@@ -199,13 +236,18 @@ class GstBuilder():
         '''
         data = None
         struct = None
-        sample = app.try_pull_sample(50000000)
-    
-        if type(sample) != Gst.Sample:
-            # Poll endlessly for a sample
-            if loop:
-                while type(sample) != Gst.Sample:
-                    sample = app.try_pull_sample(50000000)
+        sample = None
+        sample_queue = self.sample_queues.get(app.get_name())
+        if sample_queue is None:
+            # appsink not connected by this builder, pull from it directly
+            timeout = Gst.CLOCK_TIME_NONE if loop else 50 * Gst.MSECOND
+            sample = app.try_pull_sample(timeout)
+        else:
+            try:
+                # wait endlessly for a sample if looping, else give up after 50 ms
+                sample = sample_queue.get(timeout=None if loop else 0.05)
+            except queue.Empty:
+                pass
 
         if type(sample) == Gst.Sample:
             buffer = sample.get_buffer()
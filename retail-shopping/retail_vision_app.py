@@ -89,8 +89,11 @@ def application_thread(gst_conf:gst_configs.GstBuilder, model_obj:model_runner.M
     global stop_threads
     while not stop_threads:
 
-        #push an image from the last iteration first so we're able to create the display output immediately
-        drawer.push_to_display(receipt_image)
+        #push an image from the last iteration first so we're able to create the display output immediately.
+        #only newly composed images are pushed, a pushed frame gives up its buffer
+        if receipt_image is not None:
+            drawer.push_to_display(receipt_image)
+            receipt_image = None
         print('pull')
         t_start_loop = time.time()
         sample_tensor, _ = gst_conf.pull_sample(gst_conf.app_in_tensor, loop=False)
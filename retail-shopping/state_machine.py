@@ -104,7 +104,7 @@ class RetailAppFSM():
             # no foods are recognized
             out_text_receipt_color = Colors.BLACK
             out_text_receipt_text = 'Awaiting New Customer'
-            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.list_image_headers_only.copy(), out_text_receipt_text, out_text_receipt_color.value)
+            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.get_output_frame(self.display_drawer.list_image_headers_only), out_text_receipt_text, out_text_receipt_color.value)
 
 
             if utils.count_items(items) > 0:
@@ -116,7 +116,7 @@ class RetailAppFSM():
             # some foods are detected
             out_text_receipt_color = Colors.BLACK
             out_text_receipt_text = 'Hello!\nPlease hold tray still'
-            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.list_image_headers_only.copy(), out_text_receipt_text, out_text_receipt_color.value)
+            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.get_output_frame(self.display_drawer.list_image_headers_only), out_text_receipt_text, out_text_receipt_color.value)
 
             if utils.count_items(items) == 0:
                 self.state = States.IDLE_NO_FOODS
@@ -130,7 +130,7 @@ class RetailAppFSM():
             # stay in this state while the list of foods stabilizes so we're certain of the order
             out_text_receipt_color = Colors.BLACK
             out_text_receipt_text = 'Hello!\nPlease hold tray still'
-            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.list_image_headers_only.copy(), out_text_receipt_text, out_text_receipt_color.value)
+            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.get_output_frame(self.display_drawer.list_image_headers_only), out_text_receipt_text, out_text_receipt_color.value)
 
             if utils.count_items(items) == 0:
                 self.state = States.IDLE_NO_FOODS
@@ -155,11 +155,12 @@ class RetailAppFSM():
             # slow function call, intentially run only once 
             out_receipt_image = self.display_drawer.fill_receipt_image(items, self.display_drawer.list_image.copy())
 
-            # hold onto this frame. New "extra text" for user directions will be added later
+            # hold onto this frame. New "extra text" for user directions will be added later.
+            # It is kept out of the buffer pool since pushed frames are unmapped
             self.last_frame = out_receipt_image
 
             #write next set of directions/user feedback
-            out_receipt_image = self.display_drawer.draw_extra_text(self.last_frame.copy(), out_text_receipt_text, out_text_receipt_color.value)
+            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.get_output_frame(self.last_frame), out_text_receipt_text, out_text_receipt_color.value)
 
             self.state = States.AWAIT_PAYMENT
 
@@ -170,7 +171,7 @@ class RetailAppFSM():
             out_items = self.last_items
             
             #reuse last frame and draw new user feedback text
-            out_receipt_image = self.display_drawer.draw_extra_text(self.last_frame.copy(), out_text_receipt_text, out_text_receipt_color.value)
+            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.get_output_frame(self.last_frame), out_text_receipt_text, out_text_receipt_color.value)
 
             
             current_time = time.time()
@@ -185,7 +186,7 @@ class RetailAppFSM():
             out_text_receipt_color = Colors.GREEN
             out_text_receipt_text = 'Payment Received.\nHave a Nice Day!'            
             out_items = self.last_items
-            out_receipt_image = self.display_drawer.draw_extra_text(self.last_frame.copy(), out_text_receipt_text, out_text_receipt_color.value)
+            out_receipt_image = self.display_drawer.draw_extra_text(self.display_drawer.get_output_frame(self.last_frame), out_text_receipt_text, out_text_receipt_color.value)
 
             current_time = time.time()
             #check timer started in AWAIT_PAYMENT